@@ -1,8 +1,15 @@
+import fnmatch
+import time
 from importlib import reload
 
 import alertsActor.utils.sts as stsUtils
+from alertsActor.utils.configCache import configCache
+from alertsActor.utils.key import isoTimestamp
+from alertsActor.utils.stsArchive import parseTime
 import opscore.protocols.keys as keys
+import opscore.protocols.types as types
 import yaml
+from twisted.internet.threads import deferToThread
 
 reload(stsUtils)
 
@@ -20,15 +27,36 @@ class TopCmd(object):
         #
         self.vocab = [
             ('ping', '', self.ping),
-            ('status', '', self.status),
-            ('active', '', self.genActive),
-            ('triggered', '', self.genTriggered),
+            ('status', '[<actor>] [<key>]', self.status),
+            ('active', '[<actor>] [<key>]', self.genActive),
+            ('triggered', '[<actor>] [<key>]', self.genTriggered),
             ('genSTS', '', self.genSTS),
+            ('stsKey', '<stsId>', self.stsKey),
+            ('archive', '<stsId> [<start>] [<end>]', self.archive),
+            ('history', '<key> [<actor>] [<n>]', self.history),
+            ('reloadSts', '<controller>', self.reloadSts),
+            ('metrics', '', self.metrics),
+            ('profile', 'start [<duration>] [@flamegraph]', self.profileStart),
+            ('profile', 'stop', self.profileStop),
         ]
 
         # Define typed command arguments for the above commands.
         self.keys = keys.KeysDictionary("alerts_alerts", (1, 1),
+                                        keys.Key("stsId", types.Int(), help="STS radio id"),
+                                        keys.Key("controller", types.String(), help="controller name"),
+                                        keys.Key("actor", types.String(), help="only report keys from that actor"),
+                                        keys.Key("key", types.String(),
+                                                 help="only report keys matching that pattern, eg *_visTemps_*"),
+                                        keys.Key("duration", types.Float(), help="profiling duration in seconds"),
+                                        keys.Key("start", types.String(),
+                                                 help="unix timestamp or ISO date (UTC), default: one partition back"),
+                                        keys.Key("end", types.String(), help="unix timestamp or ISO date (UTC)"),
+                                        keys.Key("n", types.Int(), help="number of history entries"),
                                         )
+        # keywords are aggregated in multi-keyword reply lines.
+        self.maxKeysPerLine = 50
+        # archive queries only report the most recent datums.
+        self.maxArchivedRows = 10000
 
     def controllerKey(self):
         controllerNames = list(self.actor.controllers.keys())
@@ -47,6 +75,10 @@ class TopCmd(object):
         self.actor.sendVersionKey(cmd)
         cmd.inform(f'text="controllers: {self.actor.controllers}')
         cmd.inform(self.controllerKey())
+        cmd.inform(f'text="{self.actor.stsSender} batching:{self.actor.stsSender.batchStatus}"')
+        cmd.inform(f'text="triggered keys per controller: {self.actor.triggeredCounts}"')
+        cmd.inform(f'text="skipped evaluations per controller: {self.actor.skippedCounts}"')
+        cmd.inform(f'text="{configCache}"')
         cmd.inform('text="Present!"')
 
         triggered = self.genTriggered(cmd, doFinish=False)
@@ -56,33 +88,168 @@ class TopCmd(object):
 
         cmd.finish(self.actor.alertStatusKey)
 
+    def filterKeys(self, cmd, allKeys=None):
+        """Return keys matching optional actor and key pattern from the command."""
+        cmdKeys = cmd.cmd.keywords
+        actor = cmdKeys['actor'].values[0] if 'actor' in cmdKeys else None
+        pattern = cmdKeys['key'].values[0] if 'key' in cmdKeys else None
+
+        if allKeys is not None:
+            # copy first, given keys might be modified by other threads.
+            allKeys = list(allKeys)
+            if actor is not None:
+                allKeys = [key for key in allKeys if key.keyCB.actorRules.name == actor]
+        elif actor is None:
+            allKeys = self.actor.allKeys
+        else:
+            allKeys = self.actor.controllers[actor].allKeys() if actor in self.actor.controllers else []
+
+        if pattern is not None:
+            allKeys = [key for key in allKeys if fnmatch.fnmatchcase(key.actorKeyId, pattern)]
+
+        return allKeys
+
+    def informKeys(self, cmd, keywords):
+        """Generate keywords, aggregated in a bounded number of reply lines."""
+        for i in range(0, len(keywords), self.maxKeysPerLine):
+            cmd.inform('; '.join(keywords[i:i + self.maxKeysPerLine]))
+
     def genActive(self, cmd, doFinish=True):
         """ """
-        active = [key for key in self.actor.allKeys if key.active]
+        active = [key for key in self.filterKeys(cmd) if key.active]
+        keywords = []
 
         for key in active:
-            key.genAlertLogic(cmd)
+            keywords.append(key.alertLogicKey())
+            keywords.append(key.lastAlertKey() if key.triggered else key.lastOkKey())
 
-            if key.triggered:
-                key.genLastAlert(cmd)
-            else:
-                key.genLastOk(cmd)
+        self.informKeys(cmd, keywords)
 
         if doFinish:
             cmd.finish(self.actor.alertStatusKey)
 
     def genTriggered(self, cmd, doFinish=True):
         """ """
-        triggered = [key for key in self.actor.allKeys if key.triggered]
-
-        for key in triggered:
-            key.genLastAlert(cmd)
+        triggered = sorted(self.filterKeys(cmd, self.actor.triggeredKeys), key=lambda key: key.actorKeyId)
+        self.informKeys(cmd, [key.lastAlertKey() for key in triggered])
 
         if doFinish:
             cmd.finish(self.actor.alertStatusKey)
 
         return triggered
 
+    def metrics(self, cmd):
+        """Report alerts pipeline counters and latencies."""
+        self.actor.genMetrics(cmd)
+        cmd.finish()
+
+    def profileStart(self, cmd):
+        """Start profiling the reactor and controller threads, optionally for a given duration."""
+        cmdKeys = cmd.cmd.keywords
+        duration = cmdKeys['duration'].values[0] if 'duration' in cmdKeys else None
+
+        try:
+            self.actor.profiler.start(duration=duration, doSample='flamegraph' in cmdKeys)
+        except RuntimeError as e:
+            cmd.fail(f'text="{e}"')
+            return
+
+        cmd.finish(f'text="profiling started{f" for {duration}s" if duration is not None else ""}"')
+
+    def profileStop(self, cmd):
+        """Stop profiling and report top entries, cmd is finished once all threads stopped their profile."""
+        try:
+            self.actor.profiler.stop(cmd)
+        except RuntimeError as e:
+            cmd.fail(f'text="{e}"')
+
+    def stsKey(self, cmd):
+        """Describe the key wired to a given stsId."""
+        stsId = cmd.cmd.keywords['stsId'].values[0]
+
+        try:
+            key = self.actor.keysFromStsId[stsId]
+        except KeyError:
+            cmd.fail(f'text="stsId {stsId} is not wired to any key"')
+            return
+
+        cmd.inform(f'text="stsId {stsId} is {key.actorKeyId}: {key.stsKey.stsHelp}"')
+        key.genAlertLogic(cmd)
+        key.genKey(key.transmitted, cmd=cmd)
+        cmd.finish()
+
+    def archive(self, cmd):
+        """Report datums sent for a given stsId between start and end, the query does not run in the reactor thread."""
+        cmdKeys = cmd.cmd.keywords
+        stsId = cmdKeys['stsId'].values[0]
+
+        if self.actor.stsArchive is None:
+            cmd.fail('text="STS archive is not configured"')
+            return
+
+        try:
+            start = parseTime(cmdKeys['start'].values[0]) if 'start' in cmdKeys else None
+            end = parseTime(cmdKeys['end'].values[0]) if 'end' in cmdKeys else None
+        except ValueError as e:
+            cmd.fail(f'text="{e}"')
+            return
+
+        # bounded window by default, the whole archive could be huge.
+        if start is None:
+            start = (time.time() if end is None else end) - self.actor.stsArchive.partitionPeriod
+
+        def report(rows):
+            if len(rows) > self.maxArchivedRows:
+                cmd.warn(f'text="more than {self.maxArchivedRows} datums found, only reporting the last ones"')
+                rows = rows[-self.maxArchivedRows:]
+
+            self.informKeys(cmd, [f'archivedDatum={stsId},{isoTimestamp(timestamp)},{value},"{text}"'
+                                  for timestamp, value, text in rows])
+            cmd.finish(f'text="{len(rows)} datums archived for stsId {stsId}"')
+
+        def failed(failure):
+            cmd.fail(f'text="archive query failed: {failure.getErrorMessage()}"')
+
+        # one more row to tell whether there is more.
+        deferred = deferToThread(self.actor.stsArchive.query, stsId, start=start, end=end,
+                                 nMax=self.maxArchivedRows + 1)
+        deferred.addCallbacks(report, failed)
+
+    def history(self, cmd):
+        """Report the last evaluated values and alert status codes of keys matching a pattern."""
+        cmdKeys = cmd.cmd.keywords
+        n = cmdKeys['n'].values[0] if 'n' in cmdKeys else None
+
+        if not self.actor.actorConfig.get('historyDepth', 0):
+            cmd.fail('text="history is not enabled, set historyDepth in the actor configuration"')
+            return
+
+        matching = sorted(self.filterKeys(cmd), key=lambda key: key.actorKeyId)
+
+        if not matching:
+            cmd.fail('text="no key matching that pattern"')
+            return
+
+        # history can be long, one line per key.
+        for key in matching:
+            if key.history is not None:
+                cmd.inform(key.historyKey(n))
+
+        cmd.finish()
+
+    def reloadSts(self, cmd):
+        """Reload STS.yaml for a given controller, without restarting it."""
+        controller = cmd.cmd.keywords['controller'].values[0]
+
+        try:
+            ctrl = self.actor.controllers[controller]
+        except KeyError:
+            cmd.fail(f'text="controller {controller} is not connected"')
+            return
+
+        ctrl.reloadSts(cmd)
+        cmd.finish()
+
     def genSTS(self, cmd):
         stsConfig = dict(actors={})
         for modelName, stsPrimaryId in self.actor.stsPrimaryIds.items():
@@ -1,10 +1,15 @@
+import copy
 import logging
 import re
 from importlib import reload
 
 import alertsActor.utils.alertsFactory as alertsFactory
+import alertsActor.utils.clock as clock
 import alertsActor.utils.keyCallback as keyCB
-import ics.utils.instdata.io as instdataIO
+from alertsActor.utils.configCache import configCache
+from alertsActor.utils.deadlines import DeadlineScheduler
+from alertsActor.utils.dependencies import DependencyGraph
+from alertsActor.utils.metrics import Metrics
 from actorcore.QThread import QThread
 
 reload(keyCB)
@@ -12,11 +17,27 @@ reload(keyCB)
 
 class ActorRules(QThread):
     """ Single thread per actor. it handles connection to STS and alerts configuration """
+    # bounds of the wait between two timeout checks, in seconds.
+    minWait = 0.01
+    maxWait = 1
 
     def __init__(self, actor, name):
-        QThread.__init__(self, actor, name, timeout=15)
+        # timeouts are checked as soon as the earliest deadline is due, but at least every maxWait.
+        QThread.__init__(self, actor, name, timeout=ActorRules.maxWait)
         self.logger = logging.getLogger(f'alerts_{name}')
         self.cbs = dict()
+        # next evaluation deadline of each KeyCallback.
+        self.deadlines = DeadlineScheduler()
+        # keys which are currently triggered, maintained on each transmission.
+        self.triggered = set()
+        # last time alert state was saved.
+        self.lastSnapshot = clock.timestamp()
+        # pipeline counters and latencies.
+        self.metrics = Metrics()
+        # Monitoring logic is shared by all keys with no rule, one per activation state.
+        self.monitorings = dict()
+        # keys to re-evaluate when an input keyword of their rule changes.
+        self.dependencies = DependencyGraph(self)
 
     @property
     def model(self):
@@ -26,16 +47,52 @@ class ActorRules(QThread):
         except KeyError:
             raise KeyError(f'actor model for {self.name} is not loaded')
 
+    @property
+    def doActivate(self):
+        """Whether alerts are currently activated for that actor."""
+        return True
+
     @property
     def keyCallbacks(self):
         """ return actorModel"""
         return [cb for keyVarName, cb in self.cbs.items()]
 
+    @property
+    def nSkipped(self):
+        """Number of evaluations skipped because nothing changed."""
+        return self.metrics.counters['skipped']
+
     def allKeys(self):
-        return sum([keyCB.identify(identifier=None) for keyCB in self.keyCallbacks], [])
+        return [key for keyCB in self.keyCallbacks for key in keyCB.identify(identifier=None)]
+
+    def monitoring(self, doActivate):
+        """Return shared Monitoring logic for that activation state."""
+        try:
+            return self.monitorings[doActivate]
+        except KeyError:
+            monitoring = alertsFactory.Monitoring(self)
+            monitoring.setActivated(doActivate)
+            self.monitorings[doActivate] = monitoring
+
+        return monitoring
+
+    def setTriggered(self, key, triggered):
+        """Update triggered keys for that controller and the actor."""
+        if triggered:
+            self.triggered.add(key)
+            self.actor.triggeredKeys.add(key)
+        else:
+            self.triggered.discard(key)
+            self.actor.triggeredKeys.discard(key)
 
     def start(self, cmd):
         """ call by controller.start()"""
+        self.wire(cmd)
+
+        QThread.start(self)
+
+    def wire(self, cmd):
+        """Wire keyvars callbacks and alerts logic, without starting the thread."""
         # make sure actorName is in the models.
         if self.name not in self.actor.models:
             self.actor.addModels([self.name])
@@ -45,32 +102,42 @@ class ActorRules(QThread):
         # create and set alerts on top on that.
         self.setAlertsLogic(cmd)
 
-        QThread.start(self)
-
     def stop(self, cmd):
         """ call by controller.stop()"""
+        # save alert state before it is gone.
+        self.saveState()
+
         # remove all KeyCallback.
         for keyVarName, cb in self.cbs.items():
             self.logger.warning('removing callback: %s', cb)
             self.model[keyVarName].removeCallback(cb)
+            if isinstance(cb, keyCB.KeyCallback):
+                self.unregisterKeys(cb.keys.values())
 
         self.cbs.clear()
+        self.dependencies.clear()
+        self.deadlines.clear()
+        # those keys are gone.
+        self.actor.triggeredKeys.difference_update(self.triggered)
+        self.triggered.clear()
+
         self.exit()
 
     def loadCfg(self, fileName):
         """ Load per-actor config from instdata.config given a filename."""
-        cfg = instdataIO.loadConfig(fileName, subDirectory='alerts')
-        cfgActors = cfg['actors']
+        # parsed files are shared by all controllers.
+        cfgActors = configCache.load(fileName)['actors']
 
         # extending STS config with optional local configuration.
         if fileName == 'STS' and 'extendSTS' in self.actor.localConfig:
-            moreCfg = instdataIO.loadConfig(self.actor.localConfig['extendSTS'], subDirectory='alerts')
-            cfgActors.update(moreCfg['actors'])
+            moreCfg = configCache.load(self.actor.localConfig['extendSTS'])
+            cfgActors = dict(cfgActors, **moreCfg['actors'])
 
         if self.name not in cfgActors:
             raise RuntimeError(f'{fileName} not configured for {self.name}')
 
-        return cfgActors[self.name]
+        # per-actor view, free to be modified.
+        return copy.deepcopy(cfgActors[self.name])
 
     def loadAlertsCfg(self, cmd):
         """ Load per-actor alerts configuration """
@@ -88,20 +155,115 @@ class ActorRules(QThread):
         stsCfg = self.loadCfg('STS')
 
         for keyName, keyConfig in stsCfg.items():
-            try:
-                keyVar = self.model[keyName]
-            except KeyError:
-                raise KeyError(f'keyvar {keyName} is not in the {self.name} model')
+            self.wireCallback(keyName, keyConfig)
+
+        # resume alert state from last snapshot.
+        self.restoreState(cmd)
+
+    def restoreState(self, cmd):
+        """Restore keys alert state from the actor snapshot if any."""
+        if self.actor.snapshot is None:
+            return
+
+        try:
+            nRestored = self.actor.snapshot.load(self.allKeys())
+            cmd.inform(f'text="{self.name}: restored alert state of {nRestored} key(s) from {self.actor.snapshot}"')
+        except Exception as e:
+            cmd.warn(f'text="{self.name}: failed to restore alert state: {e}"')
+
+    def saveState(self):
+        """Save keys alert state to the actor snapshot if any."""
+        self.lastSnapshot = clock.timestamp()
+
+        if self.actor.snapshot is None:
+            return
 
-            # create a callback per keyword.
-            cb = keyCB.KeyCallback(self, keyVar.name, keyConfig)
-            self.logger.warning('wiring in %s.%s to %s', self.name, keyName, keyConfig)
+        try:
+            self.actor.snapshot.save(self.allKeys())
+        except Exception as e:
+            self.logger.warning('failed to save alert state: %s', e)
+
+    def wireCallback(self, keyName, keyConfig):
+        """Create a KeyCallback for that keyword and wire it to the keyvar."""
+        try:
+            keyVar = self.model[keyName]
+        except KeyError:
+            raise KeyError(f'keyvar {keyName} is not in the {self.name} model')
+
+        # create a callback per keyword.
+        cb = keyCB.KeyCallback(self, keyVar.name, keyConfig)
+        self.logger.warning('wiring in %s.%s to %s', self.name, keyName, keyConfig)
+
+        keyVar.addCallback(cb, callNow=False)
+        self.cbs[keyVar.name] = cb
+        self.registerKeys(cb.keys.values())
+        # give the hub a chance to refresh the keyvar before declaring it timed out.
+        self.scheduleTimeout(cb, clock.timestamp() + self.actor.actorConfig['TIMEOUT'])
+
+        return cb
+
+    def unwireCallback(self, keyName):
+        """Remove KeyCallback from that keyword."""
+        cb = self.cbs.pop(keyName)
+        self.logger.warning('removing callback: %s', cb)
+        self.model[keyName].removeCallback(cb)
+        self.deadlines.cancel(cb)
+        self.unregisterKeys(cb.keys.values())
+
+    def reloadSts(self, cmd):
+        """Reload STS.yaml, only adding/removing changed callbacks and keys, unchanged ones keep their state."""
+        stsCfg = self.loadCfg('STS')
+        wired = [keyName for keyName, cb in self.cbs.items() if isinstance(cb, keyCB.KeyCallback)]
+
+        for keyName in wired:
+            if keyName not in stsCfg:
+                cmd.inform(f'text="{self.name}: {keyName} is no longer described in STS.yaml, removing it"')
+                self.unwireCallback(keyName)
 
-            keyVar.addCallback(cb, callNow=False)
-            self.cbs[keyVar.name] = cb
+        nChanged = 0
 
-    def setAlertsLogic(self, cmd, doActivate=True):
-        """ Load per-actor alerts config, wire them to the existing KeyCallback."""
+        for keyName, keyConfig in stsCfg.items():
+            # already handled by something else than a KeyCallback.
+            if keyName in self.cbs and keyName not in wired:
+                continue
+
+            if keyName not in wired:
+                cmd.inform(f'text="{self.name}: wiring new keyword {keyName}"')
+                newKeys = self.wireCallback(keyName, keyConfig).keys.values()
+            else:
+                cb = self.cbs[keyName]
+                removedKeys, newKeys = cb.update(keyConfig)
+                self.unregisterKeys(removedKeys)
+                self.registerKeys(newKeys)
+
+                if removedKeys or newKeys:
+                    self.scheduleTimeout(cb, 0)
+
+            for key in newKeys:
+                key.resetAlertLogic(doActivate=self.doActivate)
+
+            nChanged += len(newKeys)
+
+        cmd.inform(f'text="{self.name}: {nChanged} key(s) added or modified from STS.yaml"')
+        # new keys still need their alert logic.
+        self.setAlertsLogic(cmd, doActivate=self.doActivate, doDiff=True)
+
+    def registerKeys(self, keys):
+        """Add keys to the actor-wide stsId index."""
+        for key in keys:
+            self.actor.keysFromStsId[key.stsKey.stsId] = key
+
+    def unregisterKeys(self, keys):
+        """Remove keys from the actor-wide stsId index, and from triggered keys."""
+        for key in keys:
+            if self.actor.keysFromStsId.get(key.stsKey.stsId) is key:
+                self.actor.keysFromStsId.pop(key.stsKey.stsId)
+
+            self.setTriggered(key, False)
+
+    def setAlertsLogic(self, cmd, doActivate=True, doDiff=False):
+        """ Load per-actor alerts config, wire them to the existing KeyCallback.
+        If doDiff, only keys whose rule or activation actually changed are touched."""
 
         def findIdentifier(keyName):
             """ find keyId from keyName if any."""
@@ -116,11 +278,18 @@ class ActorRules(QThread):
 
             return keyNameStripped, identifier
 
-        # first declare no logic for every keys
-        self.unsetAlertsLogic(cmd, doActivate=doActivate)
+        # configuration might have changed as well.
+        for cb in self.keyCallbacks:
+            cb.loadConfig()
+
+        if not doDiff:
+            # first declare no logic for every keys
+            self.unsetAlertsLogic(cmd, doActivate=doActivate)
 
         # load per-actor alerts config.
         alertsCfg = self.loadAlertsCfg(cmd)
+        # new rule for each key, no rule meaning just monitoring.
+        newRules = dict([(key, (None, None)) for key in self.allKeys()]) if doDiff else dict()
 
         for keyDescription, keyConfig in alertsCfg.items():
             keyVarName, identifier = findIdentifier(keyDescription)
@@ -136,12 +305,40 @@ class ActorRules(QThread):
                 cmd.warn(f'text="{self.name}: keyvar {keyVarName}[{identifier}] is not described in STS.yaml"')
                 continue
 
-            alertLogic = alertsFactory.build(self, **keyConfig)
-            # alertLogic should always be activated by default, unless if force not to.
-            alertLogic.setActivated(doActivate)
-
             for key in keys:
-                key.setAlertLogic(alertLogic)
+                newRules[key] = keyDescription, keyConfig
+
+        # rules are only built once, and shared by all matching keys.
+        alertLogics = dict()
+        nChanged = 0
+
+        for key, (keyDescription, keyConfig) in newRules.items():
+            if doDiff and key.alertConfig == keyConfig and key.active == doActivate:
+                continue
+
+            nChanged += 1
+
+            if keyConfig is None:
+                key.resetAlertLogic(doActivate=doActivate)
+                continue
+
+            if keyDescription not in alertLogics:
+                alertLogic = alertsFactory.build(self, **keyConfig)
+                # alertLogic should always be activated by default, unless if force not to.
+                alertLogic.setActivated(doActivate)
+                alertLogics[keyDescription] = alertLogic
+
+            key.setAlertLogic(alertLogics[keyDescription], alertConfig=keyConfig)
+
+        if doDiff:
+            cmd.inform(f'text="{self.name}: alerts logic changed for {nChanged} key(s)"')
+
+        # pack limits for vectorized evaluation.
+        for cb in self.keyCallbacks:
+            cb.buildLimitsEvaluator()
+
+        # wire input keywords of the custom rules.
+        self.dependencies.rebuild()
 
     def unsetAlertsLogic(self, cmd, doActivate=True):
         """Remove current alert logic from the existing callbacks."""
@@ -156,11 +353,38 @@ class ActorRules(QThread):
         for key in self.allKeys():
             key.genAlertLogic()
 
+    def scheduleTimeout(self, cb, deadline):
+        """Schedule next evaluation of that KeyCallback."""
+        self.deadlines.schedule(cb, deadline)
+
     def handleTimeout(self, cmd=None):
         if self.exitASAP:
             raise SystemExit()
 
-        # check for timeout alerts.
-        for keyVarName, cb in self.cbs.items():
-            # call callback with keyVar
-            cb(self.model[keyVarName], newValue=False)
+        now = clock.timestamp()
+
+        # periodic snapshot of alert state.
+        if now - self.lastSnapshot > self.actor.snapshotPeriod:
+            self.saveState()
+
+        # check for timeout alerts, only for keywords whose deadline has elapsed.
+        for cb in self.deadlines.due(now):
+            try:
+                # call callback with keyVar
+                cb(self.model[cb.keyVarName], newValue=False)
+            except Exception as e:
+                self.logger.exception('failed to evaluate %s.%s: %s', self.name, cb.keyVarName, e)
+                # do not lose track of it.
+                self.scheduleTimeout(cb, now + cb.refreshPeriod)
+
+        # wait until the next deadline, QThread reads timeout before each wait.
+        self.timeout = self.nextWait(clock.timestamp())
+
+    def nextWait(self, now):
+        """Return how long to wait before checking timeouts again."""
+        earliest = self.deadlines.earliest()
+
+        if earliest is None:
+            return ActorRules.maxWait
+
+        return min(max(earliest - now, ActorRules.minWait), ActorRules.maxWait)
@@ -1,13 +1,15 @@
 from importlib import reload
 
 import alertsActor.Controllers.actorRules as actorRules
+import alertsActor.utils.alertsFactory as alertsFactory
 
 reload(actorRules)
 
 
+@alertsFactory.dependsOn('turboSpeed')
 def check24VAUX(cls, value):
     """check 24V-AUX value against turbo speed."""
-    turboSpeed = cls.controller.model['turboSpeed'].getValue()
+    turboSpeed = cls.getInput('turboSpeed')
 
     turboDroppingVolt = 0 < turboSpeed < 90000
     lowerLimit = 23.0 if turboDroppingVolt else 24.0
@@ -29,6 +31,11 @@ class xcu(actorRules.ActorRules):
         actorRules.ActorRules.__init__(self, *args, **kwargs)
         self.cryoMode = None
 
+    @property
+    def doActivate(self):
+        """alerts are deactivated if cryoMode==offline."""
+        return self.cryoMode != 'offline'
+
     @property
     def keyCallbacks(self):
         """ return actorModel"""
@@ -40,9 +47,9 @@ class xcu(actorRules.ActorRules):
         keyVar = self.model['cryoMode'] if keyVar is None else keyVar
         return keyVar.getValue(doRaise=False)
 
-    def start(self, cmd):
+    def wire(self, cmd):
         """called by controller.start() ."""
-        actorRules.ActorRules.start(self, cmd)
+        actorRules.ActorRules.wire(self, cmd)
 
         # reload alerts logic on cryoMode
         self.logger.warning(f'wiring in {self.name}.cryoMode to xcu.reloadAlerts()')
@@ -56,7 +63,8 @@ class xcu(actorRules.ActorRules):
         if cryoMode != self.cryoMode:
             cmd.inform(f'text="new cryoMode:{cryoMode} reloading alerts for {self.name}"')
             # force deactivated if mode==offline.
-            self.setAlertsLogic(cmd, doActivate=cryoMode != 'offline')
+            # only touch keys whose logic actually changed.
+            self.setAlertsLogic(cmd, doActivate=cryoMode != 'offline', doDiff=True)
             self.cryoMode = cryoMode
 
     def loadAlertsCfg(self, cmd):
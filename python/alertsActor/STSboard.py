@@ -28,63 +28,294 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import asyncio
+import random
+import struct
+import time
 from argparse import ArgumentParser
 from datetime import datetime
 from logging import basicConfig, getLogger, INFO
-from socket import MSG_PEEK
-from socketserver import TCPServer, BaseRequestHandler
+
 from STSpy import Radio
 
-class RequestHandler(BaseRequestHandler):
+# capture file: magic, then one record per received chunk of complete packets.
+CAPTURE_MAGIC = b'STSC0001'
+# receive time, connection id, number of bytes.
+CAPTURE_RECORD = struct.Struct('<dHI')
+# largest packet, header included.
+MAX_PACKET = 128
+
+
+class Connection(asyncio.BufferedProtocol):
+    """STS write session, packets are received into a preallocated buffer and written as is to the capture file."""
+
+    def __init__(self, board, connId, bufferSize=65536):
+        self.board = board
+        self.connId = connId
+        self.buffer = bytearray(bufferSize)
+        self.view = memoryview(self.buffer)
+        # received data is buffer[start:end].
+        self.start = 0
+        self.end = 0
+        self.writing = False
+        self.transport = None
+        self.peer = None
+        self.connectedAt = time.time()
+        self.nPackets = 0
+        self.nBytes = 0
+        self.lastReport = (self.connectedAt, 0, 0)
+        self.disconnectAfter = board.drawDisconnect()
+
+    def __str__(self):
+        return f'Connection({self.connId}, {self.peer})'
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.peer = transport.get_extra_info('peername')
+        self.board.logger.info('%s connected', self)
+
+    def connection_lost(self, exc):
+        elapsed = max(time.time() - self.connectedAt, 1e-9)
+        self.board.logger.info('%s closed after %.1fs: %d packets, %d bytes (%.1f packets/s, %.1f bytes/s)', self,
+                               elapsed, self.nPackets, self.nBytes, self.nPackets / elapsed, self.nBytes / elapsed)
+        self.board.connections.pop(self.connId, None)
+
+    def get_buffer(self, sizehint):
+        # make room for at least a full packet, only a partial packet is ever moved.
+        if len(self.buffer) - self.end < MAX_PACKET:
+            nPending = self.end - self.start
+            self.buffer[:nPending] = bytes(self.view[self.start:self.end])
+            self.start = 0
+            self.end = nPending
+
+        return self.view[self.end:]
+
+    def buffer_updated(self, nbytes):
+        self.end += nbytes
+
+        if not self.writing:
+            self.parseCommand()
+        if self.writing:
+            self.parsePackets()
+
+        if self.start == self.end:
+            self.start = self.end = 0
+
+    def parseCommand(self):
+        """Wait for the command line, only the write command is supported."""
+        newline = self.buffer.find(b'\n', self.start, self.end)
+        if newline == -1:
+            return
+
+        command = bytes(self.view[self.start:newline]).decode(errors='replace').strip()
+        self.start = newline + 1
+
+        if not command or command[0] not in 'Ww':
+            self.board.logger.warning('%s: command %s not supported', self, command)
+            self.transport.close()
+            return
+
+        self.writing = True
+        self.board.loop.call_later(self.board.latency, self.reply, b'OK: Write On\n')
+
+    def reply(self, message):
+        if not self.transport.is_closing():
+            self.transport.write(message)
+
+    def parsePackets(self):
+        """Find complete packets, and hand them over without copying them."""
+        buffer = self.buffer
+        pos = chunkStart = self.start
+        nPackets = 0
+        endOfSession = False
+
+        while pos < self.end:
+            header = buffer[pos]
+            # MSB == 0 : no more data packet.
+            if not header & 0x80:
+                endOfSession = True
+                break
+
+            packetEnd = pos + 1 + (header & 0x7f)
+            if packetEnd > self.end:
+                break
+
+            pos = packetEnd
+            nPackets += 1
+
+        if nPackets:
+            self.board.ingest(self, self.view[chunkStart:pos], nPackets)
+            self.nPackets += nPackets
+            self.nBytes += pos - chunkStart
+
+        self.start = pos
+
+        if endOfSession:
+            self.transport.close()
+        elif self.disconnectAfter is not None and self.nPackets >= self.disconnectAfter:
+            self.board.logger.warning('%s: injecting disconnect after %d packets', self, self.nPackets)
+            self.transport.abort()
 
-    def handle(self):
+    def report(self, now):
+        """Log ingest rate since last report."""
+        lastTime, lastPackets, lastBytes = self.lastReport
+        elapsed = max(now - lastTime, 1e-9)
+        self.board.logger.info('%s: %.1f packets/s, %.1f bytes/s', self, (self.nPackets - lastPackets) / elapsed,
+                               (self.nBytes - lastBytes) / elapsed)
+        self.lastReport = (now, self.nPackets, self.nBytes)
 
-        logger = getLogger()
 
-        def _recv_packet(sock):
+class Board(object):
+    """Concurrent STS stand-in, accepting any number of simultaneous writers."""
 
-            # 0x80 | len(packet) : binary data packet
-            # MSB == 0           : no more data packet
-            header = Radio._recvn(sock, 1, MSG_PEEK)
-            if not header[0] & 0x80:
-                return None
-            packet = Radio._recv_packet(sock)
-            return packet
+    def __init__(self, capture=None, decode=False, latency=0, disconnectAfter=None, pauseEvery=None,
+                 pauseDuration=0, reportPeriod=10, seed=None):
+        self.logger = getLogger()
+        self.captureFile = open(capture, 'wb', buffering=1024 * 1024) if capture else None
+        self.decode = decode
+        self.latency = latency
+        self.disconnectAfter = disconnectAfter
+        self.pauseEvery = pauseEvery
+        self.pauseDuration = pauseDuration
+        self.reportPeriod = reportPeriod
+        self.rng = random.Random(seed)
+        self.connections = dict()
+        self.nConnections = 0
+        self.loop = None
+
+        if self.captureFile is not None:
+            self.captureFile.write(CAPTURE_MAGIC)
+
+    def drawDisconnect(self):
+        """Number of packets after which a connection is dropped, None if not injecting disconnects."""
+        if not self.disconnectAfter:
+            return None
+
+        return self.rng.randint(max(self.disconnectAfter // 2, 1), self.disconnectAfter * 3 // 2)
+
+    def newConnection(self):
+        self.nConnections += 1
+        connection = Connection(self, self.nConnections % 65536)
+        self.connections[connection.connId] = connection
+        return connection
+
+    def ingest(self, connection, packets, nPackets):
+        """Handle a chunk of complete packets."""
+        if self.captureFile is not None:
+            self.captureFile.write(CAPTURE_RECORD.pack(time.time(), connection.connId, len(packets)))
+            self.captureFile.write(packets)
+
+        if self.decode:
+            for packet in iterPackets(packets):
+                self.logger.info(Radio.unpack(bytes(packet)))
+
+    async def reportLoop(self):
+        while True:
+            await asyncio.sleep(self.reportPeriod)
+            now = time.time()
+            for connection in list(self.connections.values()):
+                connection.report(now)
+
+            if self.captureFile is not None:
+                self.captureFile.flush()
+
+    async def backPressureLoop(self):
+        """Periodically stop reading from every connection, so writers have to block."""
+        while True:
+            await asyncio.sleep(self.pauseEvery)
+            connections = [connection for connection in self.connections.values() if connection.transport]
+            self.logger.warning('injecting back-pressure for %.1fs on %d connection(s)', self.pauseDuration,
+                                len(connections))
+
+            for connection in connections:
+                connection.transport.pause_reading()
+
+            await asyncio.sleep(self.pauseDuration)
+
+            for connection in connections:
+                if not connection.transport.is_closing():
+                    connection.transport.resume_reading()
+
+    async def serve(self, address, port):
+        self.loop = asyncio.get_running_loop()
+        server = await self.loop.create_server(self.newConnection, address, port, reuse_address=True)
+        self.logger.info('Serving on {}'.format([sock.getsockname() for sock in server.sockets]))
+
+        tasks = [asyncio.create_task(self.reportLoop())]
+        if self.pauseEvery:
+            tasks.append(asyncio.create_task(self.backPressureLoop()))
 
         try:
-            command = self.request.makefile().readline().strip()
-            if command[0] in 'Ww':
-                # write command
-                self.request.sendall(b'OK: Write On\n')
-                while True:
-                    packet = _recv_packet(self.request)
-                    if not packet:
-                        break
-                    datum = Radio.unpack(packet)
-                    logger.info(datum)
-            else:
-                logger.warning('Command {} not supported'.format(command))
-        except Exception as e:
-            logger.error(e)
-            raise
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.close()
+
+    def close(self):
+        if self.captureFile is not None:
+            self.captureFile.close()
+            self.captureFile = None
+
+
+def iterPackets(chunk):
+    """Iterate over packets of a chunk, as memoryview slices."""
+    chunk = memoryview(chunk)
+    pos = 0
+
+    while pos < len(chunk):
+        packetEnd = pos + 1 + (chunk[pos] & 0x7f)
+        yield chunk[pos:packetEnd]
+        pos = packetEnd
+
+
+def readCapture(filepath):
+    """Iterate over (receive time, connection id, packet) from a capture file."""
+    with open(filepath, 'rb') as captureFile:
+        if captureFile.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError(f'{filepath} is not an STS capture file')
+
+        while True:
+            record = captureFile.read(CAPTURE_RECORD.size)
+            if len(record) < CAPTURE_RECORD.size:
+                break
+
+            recvTime, connId, nBytes = CAPTURE_RECORD.unpack(record)
+            for packet in iterPackets(captureFile.read(nBytes)):
+                yield recvTime, connId, packet
 
 
 if __name__ == '__main__':
 
     parser = ArgumentParser()
     parser.add_argument('--address', default='0.0.0.0')
-    parser.add_argument('--port', default=Radio.PORT)
+    parser.add_argument('--port', default=Radio.PORT, type=int)
     parser.add_argument('--log-file', default=datetime.now().strftime('%Y%m%d%H%M%S.log'))
     parser.add_argument('--log-level', default=INFO)
+    parser.add_argument('--capture', default=None, help='write received packets to that capture file')
+    parser.add_argument('--decode', action='store_true', help='log every decoded datum')
+    parser.add_argument('--report-period', default=10, type=float, help='ingest rate reporting period in seconds')
+    parser.add_argument('--latency', default=0, type=float, help='delay write command reply by that many seconds')
+    parser.add_argument('--disconnect-after', default=None, type=int,
+                        help='drop connections after about that many packets')
+    parser.add_argument('--pause-every', default=None, type=float, help='stop reading every that many seconds')
+    parser.add_argument('--pause-duration', default=1, type=float, help='for that many seconds')
+    parser.add_argument('--seed', default=None, type=int)
+    parser.add_argument('--dump', default=None, help='print datums from a capture file and exit')
     args, _ = parser.parse_known_args()
 
+    if args.dump:
+        for recvTime, connId, packet in readCapture(args.dump):
+            print(recvTime, connId, Radio.unpack(bytes(packet)))
+        raise SystemExit()
+
     basicConfig(filename=args.log_file, level=args.log_level, format='{asctime:s} [{levelname:s}] {message:s}', style='{')
-    logger = getLogger()
 
-    with TCPServer((args.address, args.port), RequestHandler) as server:
-        server.allow_reuse_address = True
-        logger.info('Serving on {}'.format(server.server_address))
-        try:
-            server.serve_forever()
-        except KeyboardInterrupt:
-            pass
+    board = Board(capture=args.capture, decode=args.decode, latency=args.latency,
+                  disconnectAfter=args.disconnect_after, pauseEvery=args.pause_every,
+                  pauseDuration=args.pause_duration, reportPeriod=args.report_period, seed=args.seed)
+    try:
+        asyncio.run(board.serve(args.address, args.port))
+    except KeyboardInterrupt:
+        pass
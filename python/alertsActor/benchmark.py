@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+
+import argparse
+import importlib
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import yaml
+from alertsActor.utils import sts as stsUtils
+from alertsActor.utils.configCache import configCache
+from alertsActor.utils.metrics import LatencyHistogram
+from alertsActor.utils.offline import OfflineActor
+
+# keywords driving the controllers themselves rather than being monitored, not generated.
+CONTROL_KEYWORDS = ['cryoMode']
+
+# keywords need to time out within the simulated duration.
+DEFAULT_CONFIG = dict(TIMEOUT=60)
+
+SCENARIOS = dict(nominal=dict(),
+                 static=dict(changeRatio=0.),
+                 invalid=dict(invalidRatio=0.1),
+                 timeouts=dict(silentRatio=0.2),
+                 fast=dict(rate=10.))
+
+
+def partFromModel(modelName):
+    """Return the alerts part generating that model, see sts.parseAlertsModels()."""
+    return modelName[len('xcu_'):] if modelName.startswith('xcu_') else modelName
+
+
+def scaleConfig(cfgActors, models, cmd=None):
+    """Generate per-model configuration for the given models, models which are not described are built from
+    another model of the same controller, shifting stsIds by their difference of STS base id."""
+    scaled = dict()
+
+    for modelName, stsBase in models.items():
+        if modelName in cfgActors:
+            scaled[modelName] = cfgActors[modelName]
+            continue
+
+        controllerName, __ = stsUtils.controllerFromModel(modelName)
+        templates = [name for name in cfgActors if stsUtils.controllerFromModel(name)[0] == controllerName]
+
+        if not templates:
+            logging.warning('no configuration to generate %s from, skipping it', modelName)
+            continue
+
+        template = sorted(templates)[0]
+        try:
+            [templateBase] = stsUtils.parseAlertsModels([partFromModel(template)], cmd=cmd).values()
+        except ValueError:
+            logging.warning('cannot find STS base id of %s, skipping %s', template, modelName)
+            continue
+
+        scaled[modelName] = shiftStsIds(cfgActors[template], stsBase - templateBase)
+
+    return scaled
+
+
+def shiftStsIds(cfg, offset):
+    """Return a copy of an actor STS configuration, with shifted stsIds."""
+    if isinstance(cfg, dict):
+        return dict([(key, value + offset if key == 'stsId' else shiftStsIds(value, offset))
+                     for key, value in cfg.items()])
+    elif isinstance(cfg, list):
+        return [shiftStsIds(value, offset) for value in cfg]
+
+    return cfg
+
+
+def genLimitsRules(stsCfg, controllerName):
+    """Generate a limits rule for each floating point keyword, values being drawn from N(0,1)."""
+    rules = dict()
+
+    for keyName, stsMaps in stsCfg.items():
+        if any([stsMap['stsType'] == 'FLOAT+TEXT' for stsMap in stsMaps]):
+            rules[keyName] = dict(alertType='limits', limits=[-3, 3], lowerBoundInclusive=True,
+                                  upperBoundInclusive=True, alertFmt='{value} out of limits')
+
+    # xcu rules are described per cryoMode.
+    return dict(all=rules) if controllerName == 'xcu' else rules
+
+
+def genUpdates(stsCfgs, duration, startTime, rate=1., changeRatio=1., invalidRatio=0., silentRatio=0., seed=0):
+    """Generate keyvar updates for every keyword described in STS configuration.
+    Each keyword is updated at the given rate, a field keeps its value with 1-changeRatio probability, and is invalid
+    with invalidRatio probability. silentRatio of the keywords stop being updated halfway, and eventually time out."""
+    rng = random.Random(seed)
+    keywords = []
+
+    # sorted, so the same keywords are drawn whatever the configuration ordering.
+    for actor, stsCfg in sorted(stsCfgs.items()):
+        for keyName, stsMaps in sorted(stsCfg.items()):
+            if keyName in CONTROL_KEYWORDS:
+                continue
+
+            types = dict([(stsMap['keyId'], stsMap['stsType']) for stsMap in stsMaps])
+            nFields = max(types) + 1
+            isFloat = [types.get(keyId, 'FLOAT+TEXT') == 'FLOAT+TEXT' for keyId in range(nFields)]
+            # phase within the update period, and whether that keyword goes silent.
+            keywords.append((rng.random() / rate, actor, keyName, isFloat, rng.random() < silentRatio))
+
+    keywords.sort()
+    values = dict()
+
+    def genValue(isFloat):
+        return rng.gauss(0, 1) if isFloat else rng.randint(0, 3)
+
+    updates = []
+
+    for iPeriod in range(int(duration * rate)):
+        periodStart = startTime + iPeriod / rate
+        halfway = iPeriod >= duration * rate / 2
+
+        for phase, actor, keyName, isFloat, goesSilent in keywords:
+            if halfway and goesSilent:
+                continue
+
+            lastValues = values.get((actor, keyName))
+            newValues = [genValue(fieldIsFloat) if lastValues is None or rng.random() < changeRatio else lastValue
+                         for fieldIsFloat, lastValue in zip(isFloat, lastValues if lastValues else isFloat)]
+            values[actor, keyName] = newValues
+
+            if invalidRatio:
+                newValues = [None if rng.random() < invalidRatio else value for value in newValues]
+
+            updates.append((periodStart + phase, actor, keyName, newValues))
+
+    return updates
+
+
+def runScenario(stsCfgs, duration, actorConfig=None, rate=1., changeRatio=1., invalidRatio=0., silentRatio=0.,
+                seed=0):
+    """Run a single scenario, return its results."""
+    startTime = 1.6e9
+    updates = genUpdates(stsCfgs, duration, startTime, rate=rate, changeRatio=changeRatio,
+                         invalidRatio=invalidRatio, silentRatio=silentRatio, seed=seed)
+
+    actor = OfflineActor(actorConfig)
+    # configuration and controllers modules are loaded once for all, they should not be accounted per key.
+    for fileName in ['STS', 'keywordAlerts']:
+        configCache.load(fileName)
+    for modelName in stsCfgs:
+        importlib.import_module(f'alertsActor.Controllers.{stsUtils.controllerFromModel(modelName)[0]}')
+
+    # memory is only traced while wiring, tracemalloc would skew timing otherwise.
+    tracemalloc.start()
+    before, __ = tracemalloc.get_traced_memory()
+    actor.attachControllers(stsCfgs.keys(), startTime=startTime)
+    after, __ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # keys are unregistered once detached.
+    nKeys = len(actor.keysFromStsId)
+
+    try:
+        elapsed = actor.replay(updates)
+        # timeouts are still checked until the end.
+        actor.advance(startTime + duration)
+    finally:
+        actor.detachControllers()
+
+    callback = LatencyHistogram()
+    counters = dict()
+
+    for ctrl in actor.controllers.values():
+        callback.merge(ctrl.metrics.histograms['callback'])
+        for name, count in ctrl.metrics.counters.items():
+            counters[name] = counters.get(name, 0) + count
+
+    nUpdates, nCalls, mean, p50, p99, maxLatency = [actor.nUpdates] + callback.values()
+
+    return dict(keys=nKeys, updates=nUpdates, callbacks=nCalls, elapsed=round(elapsed, 3),
+                updatesPerSec=round(nUpdates / elapsed, 1) if elapsed else 0.,
+                callbackMean=mean, callbackP50=p50, callbackP99=p99, callbackMax=maxLatency,
+                bytesPerKey=round((after - before) / nKeys, 1) if nKeys else 0.,
+                stsDatumsPerSec=round(actor.stsSender.nDatums / duration, 2),
+                stsBytesPerSec=round(actor.stsSender.nBytes / duration, 1),
+                transitions=len(actor.stsSender.transitions), counters=counters)
+
+
+def gitCommit():
+    """Return current commit of this repository, if any."""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(results, reference):
+    """Print relative change of each scenario result against reference results."""
+    print(f'\ncompared to {reference["commit"]} ({reference["date"]}):')
+
+    for scenario, scenarioResults in results['scenarios'].items():
+        if scenario not in reference['scenarios']:
+            continue
+
+        changes = []
+        for name in ['updatesPerSec', 'callbackP50', 'callbackP99', 'bytesPerKey', 'stsBytesPerSec']:
+            refValue = reference['scenarios'][scenario].get(name)
+            if refValue:
+                changes.append(f'{name}={100 * (scenarioResults[name] - refValue) / refValue:+.1f}%')
+
+        print(f'  {scenario}: {", ".join(changes)}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the alerts pipeline against stub keyvars.')
+    parser.add_argument('--sts', default=None, type=str, help='STS.yaml to use instead of instdata')
+    parser.add_argument('--alerts', default=None, type=str,
+                        help='keywordAlerts.yaml to use, default: limits rule on each floating point keyword')
+    parser.add_argument('--config', default=None, type=str, help='actor configuration file (TIMEOUT, ...)')
+    parser.add_argument('--sms', default=1, type=int, help='number of spectrograph modules')
+    parser.add_argument('--parts', default=[], type=str, nargs='*', help='additional alerts parts')
+    parser.add_argument('--scenarios', default=list(SCENARIOS), type=str, nargs='*', choices=list(SCENARIOS))
+    parser.add_argument('--duration', default=300, type=float, help='simulated duration in seconds')
+    parser.add_argument('--rate', default=None, type=float, help='update rate of each keyword in Hz')
+    parser.add_argument('--invalidRatio', default=None, type=float, help='ratio of invalid values')
+    parser.add_argument('--silentRatio', default=None, type=float, help='ratio of keywords timing out')
+    parser.add_argument('--seed', default=0, type=int)
+    parser.add_argument('--output', default=None, type=str, help='write json results to that file')
+    parser.add_argument('--compare', default=None, type=str, help='json results to compare to')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+
+    parts = [f'sm{smNum}' for smNum in range(1, args.sms + 1)] + args.parts
+    models = stsUtils.parseAlertsModels(parts)
+
+    if args.sts:
+        configCache.pin('STS', args.sts)
+
+    stsCfgs = scaleConfig(configCache.load('STS')['actors'], models)
+
+    if args.alerts:
+        alertsCfgs = scaleConfig(configCache.load('keywordAlerts')['actors'], models)
+    else:
+        alertsCfgs = dict([(modelName, genLimitsRules(stsCfg, stsUtils.controllerFromModel(modelName)[0]))
+                           for modelName, stsCfg in stsCfgs.items()])
+
+    actorConfig = dict(DEFAULT_CONFIG)
+    if args.config:
+        with open(args.config, 'r') as cfgFile:
+            actorConfig.update(yaml.safe_load(cfgFile))
+
+    # overrides from the command line.
+    overrides = dict([(name, getattr(args, name)) for name in ['rate', 'invalidRatio', 'silentRatio']
+                      if getattr(args, name) is not None])
+    results = dict(commit=gitCommit(), date=time.strftime('%Y-%m-%dT%H:%M:%S'), python=platform.python_version(),
+                   parts=parts, duration=args.duration, seed=args.seed, overrides=overrides, scenarios=dict())
+
+    with tempfile.TemporaryDirectory() as tmpDir:
+        # scaled configuration is what the controllers will load.
+        for fileName, cfgActors in [('STS', stsCfgs), ('keywordAlerts', alertsCfgs)]:
+            filepath = os.path.join(tmpDir, f'{fileName}.yaml')
+            with open(filepath, 'w') as cfgFile:
+                yaml.safe_dump(dict(actors=cfgActors), cfgFile)
+            configCache.pin(fileName, filepath)
+
+        for scenario in args.scenarios:
+            params = dict(SCENARIOS[scenario], **overrides)
+            scenarioResults = runScenario(stsCfgs, args.duration, actorConfig=actorConfig, seed=args.seed, **params)
+            results['scenarios'][scenario] = dict(params=params, **scenarioResults)
+            print(f'{scenario}: {json.dumps(scenarioResults)}')
+
+    if args.output:
+        with open(args.output, 'w') as outputFile:
+            json.dump(results, outputFile, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r') as referenceFile:
+            compare(results, json.load(referenceFile))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,14 @@ import logging
 
 from actorcore import ICC
 from alertsActor.utils import sts as stsUtils
+from alertsActor.utils.profiler import ActorProfiler
+from alertsActor.utils.snapshot import StateSnapshot
+from alertsActor.utils.stsArchive import StsArchive
+from alertsActor.utils.stsSender import StsSender
+from alertsActor.utils.stsSpool import StsSpool
 from ics.utils.sps.spectroIds import getSite
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
 
 
 class OurActor(ICC.ICC):
@@ -28,9 +35,45 @@ class OurActor(ICC.ICC):
 
         self.logger.setLevel(logLevel)
         self.aliveAlerts = dict()
+        # all triggered keys, maintained by the controllers.
+        self.triggeredKeys = set()
+        # stsId -> Key index, maintained by the controllers.
+        self.keysFromStsId = dict()
 
         parts = self.localConfig['parts']
         self.stsPrimaryIds = stsUtils.parseAlertsModels(parts, cmd=self.bcast)
+        # on-demand profiler.
+        self.profiler = ActorProfiler(self, self.actorConfig.get('profileDir', '/tmp'))
+
+        # optional alert state snapshot, for fast warm restart.
+        snapshotConfig = self.actorConfig.get('snapshot', None)
+        self.snapshot = StateSnapshot(snapshotConfig['path']) if snapshotConfig else None
+        self.snapshotPeriod = snapshotConfig.get('period', 60) if snapshotConfig else 60
+
+        # optional store-and-forward spool for STS outages.
+        spoolConfig = self.actorConfig.get('stsSpool', None)
+        spool = StsSpool(spoolConfig['path'],
+                         segmentSize=spoolConfig.get('segmentSize', 4 * 1024 * 1024),
+                         maxSegments=spoolConfig.get('maxSegments', 64)) if spoolConfig else None
+        # optional archive of every datum acknowledged by STS.
+        archiveConfig = self.actorConfig.get('stsArchive', None)
+        self.stsArchive = None
+        if archiveConfig:
+            self.stsArchive = StsArchive(archiveConfig['path'], partitionPeriod=archiveConfig.get('partitionPeriod', 86400),
+                                         reindexRows=archiveConfig.get('reindexRows', 100000))
+        # single pool of persistent STS connections shared by all controllers.
+        self.stsSender = StsSender(self.stsHost,
+                                   nConnections=self.localConfig.get('stsConnections', 1),
+                                   queueSize=self.actorConfig.get('stsQueueSize', 1000),
+                                   dropPolicy=self.actorConfig.get('stsDropPolicy', 'oldest'),
+                                   batchWindow=self.actorConfig.get('stsBatchWindow', 0.1),
+                                   batchSize=self.actorConfig.get('stsBatchSize', 500),
+                                   spool=spool,
+                                   replayRate=spoolConfig.get('replayRate', 1000) if spoolConfig else 0,
+                                   archive=self.stsArchive)
+        self.stsSender.start()
+        # close STS sessions, spool and archive properly, so that archive partitions get indexed.
+        reactor.addSystemEventTrigger('before', 'shutdown', self.stsSender.close)
 
     @property
     def localConfig(self):
@@ -43,34 +86,37 @@ class OurActor(ICC.ICC):
     def connectionMade(self):
         if self.everConnected is False:
             self.everConnected = True
+            # periodic summary of the pipeline metrics.
+            self.metricsLoop = LoopingCall(self.genMetrics)
+            self.metricsLoop.start(self.actorConfig.get('metricsPeriod', 300), now=False)
             models = self.stsPrimaryIds.keys()
             logging.info("loading STS models: %s", models)
             self.addModels(self.stsPrimaryIds.keys())
 
             # While we are here, load the actor rules.
             for model in models:
-                # Should have normalized rough actor names to rough_N.
-                if '_' in model:
-                    name = model
-                    model = name.split('_')[0]
-                elif model[-1].isdigit():
-                    name = model
-                    model = model[:-1]
-                else:
-                    name = model
-
+                model, name = stsUtils.controllerFromModel(model)
                 self.callCommand(f'connect controller={model} name={name}')
 
     @property
     def allKeys(self):
-        return sum([list(cb.keys.values()) for ctrl in self.controllers.values() for cb in ctrl.keyCallbacks], [])
+        return [key for ctrl in self.controllers.values() for cb in ctrl.keyCallbacks for key in cb.keys.values()]
 
     @property
     def alertStatus(self):
-        triggered = [key for key in self.allKeys if key.triggered]
-        status = 'ALERT' if triggered else 'OK'
+        status = 'ALERT' if self.triggeredKeys else 'OK'
         return status
 
+    @property
+    def triggeredCounts(self):
+        """Number of triggered keys per controller."""
+        return dict([(name, len(ctrl.triggered)) for name, ctrl in self.controllers.items()])
+
+    @property
+    def skippedCounts(self):
+        """Number of skipped evaluations per controller."""
+        return dict([(name, ctrl.nSkipped) for name, ctrl in self.controllers.items()])
+
     @property
     def alertStatusKey(self):
         return f'alertStatus={self.alertStatus}'
@@ -85,6 +131,15 @@ class OurActor(ICC.ICC):
         ICC.ICC.detachController(self, *args, **kwargs)
         self.genAlertStatus()
 
+    def genMetrics(self, cmd=None):
+        """Generate pipeline metrics keywords for each controller and the STS sender."""
+        cmd = self.bcast if cmd is None else cmd
+
+        for name, ctrl in list(self.controllers.items()):
+            cmd.inform(ctrl.metrics.genKey(name))
+
+        cmd.inform(self.stsSender.genMetricsKey())
+
     def genAlertStatus(self):
         """generate overall alertStatus if necessary."""
         previous = self.models['alerts'].keyVarDict['alertStatus'].getValue(doRaise=False)
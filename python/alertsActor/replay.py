@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+import argparse
+import logging
+from itertools import chain
+
+import yaml
+from alertsActor.utils.configCache import configCache
+from alertsActor.utils.offline import OfflineActor, RecordingSender, readCapture
+
+
+def replayCapture(capturePath, models=None, actorConfig=None, localConfig=None, tickPeriod=1,
+                  datumsPath=None, repliesPath=None):
+    """Replay a capture file through the alerts rules, return the offline actor and elapsed time."""
+    datumsFile = open(datumsPath, 'w') if datumsPath else None
+    repliesFile = open(repliesPath, 'w') if repliesPath else None
+
+    try:
+        # wire every model found in the capture by default.
+        if models is None:
+            models = sorted(set([actor for timestamp, actor, keyName, values in readCapture(capturePath)]))
+
+        updates = readCapture(capturePath)
+        try:
+            first = next(updates)
+        except StopIteration:
+            raise ValueError(f'{capturePath} is empty')
+
+        actor = OfflineActor(actorConfig, localConfig=localConfig, tickPeriod=tickPeriod, output=repliesFile)
+        actor.stsSender = RecordingSender(actor.keysFromStsId, output=datumsFile)
+
+        actor.attachControllers(models, startTime=first[0])
+        try:
+            elapsed = actor.replay(chain([first], updates))
+        finally:
+            actor.detachControllers()
+    finally:
+        for outputFile in [datumsFile, repliesFile]:
+            if outputFile is not None:
+                outputFile.close()
+
+    return actor, elapsed
+
+
+def report(actor, elapsed):
+    """Print datums, transitions and per-stage timing summary."""
+    sender = actor.stsSender
+    print(f'replayed {actor.nUpdates} updates in {elapsed:.3f}s ({actor.nUpdates / max(elapsed, 1e-9):.0f} updates/s)')
+    print(f'STS: {sender.nDatums} datums, {sender.nBytes} bytes, {len(sender.transitions)} alert transitions')
+    print(f'replies: {", ".join([f"{level}={count}" for level, count in actor.bcast.counts.items()])}')
+
+    print('\nalert transitions (timestamp, stsId, key, from, to):')
+    for timestamp, stsId, actorKeyId, prevText, stsText in sender.transitions:
+        print(f'  {timestamp} {stsId} {actorKeyId} "{prevText}" -> "{stsText}"')
+
+    print('\nalertStatus changes:')
+    for timestamp, alertStatus in actor.alertStatusChanges:
+        print(f'  {timestamp:.3f} {alertStatus}')
+
+    print('\ntiming (count, mean, p50, p99, max in ms):')
+    for stage, histogram in actor.latencies.items():
+        print(f'  {stage}: {histogram.values()}')
+
+    for name, ctrl in actor.controllers.items():
+        for stage, histogram in ctrl.metrics.histograms.items():
+            print(f'  {name}.{stage}: {histogram.values()}')
+        print(f'  {name} counters: {ctrl.metrics.counters}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='replay recorded keyvar updates through the alerts rules, '
+                                                 'without hub or STS.')
+    parser.add_argument('capture', type=str,
+                        help='capture file, one [timestamp, actor, key, values] json per line, enums as objects')
+    parser.add_argument('--sts', default=None, type=str, help='STS.yaml to use instead of instdata')
+    parser.add_argument('--alerts', default=None, type=str, help='keywordAlerts.yaml to use instead of instdata')
+    parser.add_argument('--config', default=None, type=str, help='actor configuration file (TIMEOUT, ...)')
+    parser.add_argument('--models', default=None, type=str, nargs='*', help='models to wire, default: all captured')
+    parser.add_argument('--tick', default=1, type=float, help='timeouts checking period in seconds')
+    parser.add_argument('--datums', default=None, type=str, help='write transmitted datums to that csv file')
+    parser.add_argument('--replies', default=None, type=str, help='write generated replies to that file')
+    parser.add_argument('--logLevel', default=logging.WARNING, type=int, help='logging level')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.logLevel)
+
+    if args.sts:
+        configCache.pin('STS', args.sts)
+    if args.alerts:
+        configCache.pin('keywordAlerts', args.alerts)
+
+    actorConfig = dict()
+    if args.config:
+        with open(args.config, 'r') as cfgFile:
+            actorConfig = yaml.safe_load(cfgFile)
+
+    actor, elapsed = replayCapture(args.capture, models=args.models, actorConfig=actorConfig, tickPeriod=args.tick,
+                                   datumsPath=args.datums, repliesPath=args.replies)
+    report(actor, elapsed)
+
+
+if __name__ == '__main__':
+    main()
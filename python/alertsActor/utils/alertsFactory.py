@@ -1,7 +1,22 @@
 import importlib
+import operator
 import re
 from functools import partial
 
+from alertsActor.utils.key import MhsKey
+
+
+def dependsOn(*inputs):
+    """Declare the keywords a custom routine reads besides the checked value, so it is re-evaluated when they change.
+    An input is either a keyName of the controller model, modelName.keyName, or a function of the controller
+    returning a list of those."""
+
+    def decorator(func):
+        func.inputs = inputs
+        return func
+
+    return decorator
+
 
 class Alert(object):
     def __init__(self, controller, call=True, alertFmt=None):
@@ -9,6 +24,13 @@ class Alert(object):
         self.alertFmt = alertFmt
 
         self.activated = True
+        # description is only built once, see __str__.
+        self._description = None
+        # custom routines might depend on other keywords.
+        self.isCustom = not isinstance(call, bool)
+        # declared (modelName, keyName) inputs, and their last value.
+        self.inputs = None
+        self.inputValues = dict()
 
         # just call regular check
         if isinstance(call, bool):
@@ -17,14 +39,61 @@ class Alert(object):
         else:
             modname, funcname = call.split('.')
             module = importlib.import_module(f'alertsActor.Controllers.{modname}')
-            self.call = partial(getattr(module, funcname), self)
+            func = getattr(module, funcname)
+            self.call = partial(func, self)
+            self.inputs = self.resolveInputs(getattr(func, 'inputs', None))
 
     def __str__(self):
         """Overriden by OFF if deactivated"""
         if not self.activated:
             return 'OFF'
 
-        return self.describe()
+        if self._description is None:
+            self._description = self.describe()
+
+        return self._description
+
+    @property
+    def isCacheable(self):
+        """Whether alert state only depends on the value and declared inputs, so unchanged values can be skipped."""
+        return not self.isCustom or self.inputs is not None
+
+    def resolveInputs(self, inputs):
+        """Return declared inputs as a list of (modelName, keyName)."""
+        if inputs is None:
+            return None
+
+        resolved = []
+
+        for declared in inputs:
+            for inputName in (declared(self.controller) if callable(declared) else [declared]):
+                resolved.append(self.inputId(inputName))
+
+        return resolved
+
+    def inputId(self, inputName):
+        """Return (modelName, keyName) from keyName or modelName.keyName."""
+        modelName, keyName = inputName.split('.') if '.' in inputName else (self.controller.name, inputName)
+        return modelName, keyName
+
+    def setInput(self, inputId, value):
+        """Cache last input value, called each time that input keyword is updated."""
+        self.inputValues[inputId] = value
+
+    def getInput(self, inputName, doRaise=True):
+        """Return cached input value, read from the model if it has not been cached yet."""
+        inputId = self.inputId(inputName)
+
+        try:
+            value = self.inputValues[inputId]
+        except KeyError:
+            modelName, keyName = inputId
+            value = self.controller.actor.models[modelName].keyVarDict[keyName].getValue(doRaise=False)
+
+        if doRaise and MhsKey.isInvalid(value):
+            raise ValueError(f'{inputName} value is invalid')
+
+        return value
 
     def check(self, value):
         """Overriden by OK if deactivated."""
@@ -74,12 +143,49 @@ class LimitsAlert(Alert):
         lowerLimit = LimitsAlert.noLowerLimit if lowerLimit is None else lowerLimit
         upperLimit = LimitsAlert.noUpperLimit if upperLimit is None else upperLimit
 
-        self.lowerLimit = lowerLimit
-        self.upperLimit = upperLimit
-
         self.lowerBoundInclusive = lowerBoundInclusive
         self.upperBoundInclusive = upperBoundInclusive
 
+        self._lowerLimit = lowerLimit
+        self._upperLimit = upperLimit
+        self.compile()
+
+    @property
+    def lowerLimit(self):
+        return self._lowerLimit
+
+    @lowerLimit.setter
+    def lowerLimit(self, lowerLimit):
+        """Custom routines can move the limits, logic needs to be compiled again."""
+        self._lowerLimit = lowerLimit
+        self.compile()
+
+    @property
+    def upperLimit(self):
+        return self._upperLimit
+
+    @upperLimit.setter
+    def upperLimit(self, upperLimit):
+        """Custom routines can move the limits, logic needs to be compiled again."""
+        self._upperLimit = upperLimit
+        self.compile()
+
+    def compile(self):
+        """Build a specialized comparison once, only checking the bounds which are actually defined."""
+        lowerLimit, upperLimit = self.lowerLimit, self.upperLimit
+        lowerOK = partial(operator.le if self.lowerBoundInclusive else operator.lt, lowerLimit)
+        upperOK = partial(operator.ge if self.upperBoundInclusive else operator.gt, upperLimit)
+
+        if lowerLimit == self.noLowerLimit:
+            self.withinLimits = upperOK
+        elif upperLimit == self.noUpperLimit:
+            self.withinLimits = lowerOK
+        else:
+            self.withinLimits = lambda value: lowerOK(value) and upperOK(value)
+
+        # description needs to be regenerated.
+        self._description = None
+
     def describe(self):
         logic1 = '<=' if self.lowerBoundInclusive else '<'
         logic2 = '<=' if self.upperBoundInclusive else '<'
@@ -96,12 +202,20 @@ class LimitsAlert(Alert):
 
     def checkAgainstLogic(self, value):
         """Check value against limits."""
-        alertState = 'OK'
+        return self.genAlertState(value, self.withinLimits(value))
+
+    def checkEvaluated(self, value, withinLimits):
+        """Same as check(), but limits have already been evaluated (see LimitsEvaluator)."""
+        if not self.activated:
+            return 'OK'
+
+        return self.genAlertState(value, withinLimits)
 
-        lowerBoundOK = value >= self.lowerLimit if self.lowerBoundInclusive else value > self.lowerLimit
-        upperBoundOK = value <= self.upperLimit if self.upperBoundInclusive else value < self.upperLimit
+    def genAlertState(self, value, withinLimits):
+        """Generate alertState from limits evaluation."""
+        alertState = 'OK'
 
-        if not (lowerBoundOK and upperBoundOK):
+        if not withinLimits:
             alertState = self.alertFmt.format(value=value, lowerLimit=self.lowerLimit, upperLimit=self.upperLimit)
 
         return alertState
@@ -114,6 +228,7 @@ class RegexpAlert(Alert):
         Alert.__init__(self, *args, **kwargs)
         pattern = r"^OK$" if pattern is None else pattern
         self.pattern = pattern
+        self.regexp = re.compile(pattern)
         self.invert = invert
 
     def describe(self):
@@ -124,7 +239,7 @@ class RegexpAlert(Alert):
         """Check value against pattern."""
         alertState = 'OK'
         # alert is triggered is pattern is not matched.
-        alertTriggered = re.match(self.pattern, value) is None
+        alertTriggered = self.regexp.match(value) is None
         # reverse logic if self.invert==True.
         alertTriggered = not alertTriggered if self.invert else alertTriggered
 
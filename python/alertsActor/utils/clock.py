@@ -0,0 +1,15 @@
+import ics.utils.time as pfsTime
+
+# current time source of the alerts pipeline.
+timestamp = pfsTime.timestamp
+
+
+def setClock(func):
+    """Replace the time source of the alerts pipeline, eg by a fake clock for offline replay."""
+    global timestamp
+    timestamp = func
+
+
+def resetClock():
+    """Go back to wall clock time."""
+    setClock(pfsTime.timestamp)
@@ -0,0 +1,74 @@
+import os
+import threading
+
+import ics.utils.instdata.io as instdataIO
+import yaml
+
+
+class ConfigCache(object):
+    """Process-wide cache of parsed instdata configuration files.
+    A file is only parsed again if its modification time changed, files which cannot be found are never cached."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cache = dict()
+        # files loaded from an explicit path instead of instdata, eg for offline replay.
+        self.pinned = dict()
+        self.nHits = 0
+        self.nMisses = 0
+
+    def __str__(self):
+        return f'ConfigCache(files={len(self.cache)}, hits={self.nHits}, misses={self.nMisses})'
+
+    @staticmethod
+    def filepath(fileName, subDirectory):
+        """Return the path of that configuration file in instdata."""
+        return os.path.join(os.environ.get('PFS_INSTDATA_DIR', ''), 'config', subDirectory, f'{fileName}.yaml')
+
+    @staticmethod
+    def getMtime(filepath):
+        """Return file modification time, None if it cannot be found."""
+        try:
+            return os.stat(filepath).st_mtime_ns
+        except OSError:
+            return None
+
+    def pin(self, fileName, filepath):
+        """Load that configuration from the given file instead of instdata."""
+        with self.lock:
+            self.pinned[fileName] = os.path.abspath(filepath)
+
+    def parse(self, fileName, subDirectory):
+        """Parse configuration file, from instdata unless it has been pinned."""
+        if fileName not in self.pinned:
+            return instdataIO.loadConfig(fileName, subDirectory=subDirectory)
+
+        with open(self.pinned[fileName], 'r') as cfgFile:
+            return yaml.safe_load(cfgFile)
+
+    def load(self, fileName, subDirectory='alerts'):
+        """Return parsed configuration, note that it is shared so callers must not modify it."""
+        filepath = self.pinned.get(fileName, ConfigCache.filepath(fileName, subDirectory))
+        mtime = ConfigCache.getMtime(filepath)
+
+        with self.lock:
+            try:
+                cachedMtime, cfg = self.cache[filepath]
+                if mtime is not None and cachedMtime == mtime:
+                    self.nHits += 1
+                    return cfg
+            except KeyError:
+                pass
+
+            self.nMisses += 1
+            cfg = self.parse(fileName, subDirectory)
+            # instdata might resolve that file elsewhere, it cannot be told whether it changed then.
+            if mtime is None:
+                self.cache.pop(filepath, None)
+            else:
+                self.cache[filepath] = mtime, cfg
+
+        return cfg
+
+
+configCache = ConfigCache()
@@ -0,0 +1,56 @@
+import heapq
+import itertools
+import threading
+
+
+class DeadlineScheduler(object):
+    """Heap of deadlines, keyed by item. Rescheduling an item just invalidates its previous heap entry."""
+
+    def __init__(self):
+        self.heap = []
+        self.deadlines = dict()
+        self.lock = threading.Lock()
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def schedule(self, item, deadline):
+        """Set (or move) item deadline."""
+        with self.lock:
+            self.deadlines[item] = deadline
+            heapq.heappush(self.heap, (deadline, next(self.counter), item))
+
+            # drop stale entries once they outnumber the valid ones.
+            if len(self.heap) > 4 * len(self.deadlines) + 64:
+                self.heap = [(deadline, next(self.counter), item) for item, deadline in self.deadlines.items()]
+                heapq.heapify(self.heap)
+
+    def cancel(self, item):
+        """Forget about that item."""
+        with self.lock:
+            self.deadlines.pop(item, None)
+
+    def clear(self):
+        with self.lock:
+            self.deadlines.clear()
+            self.heap.clear()
+
+    def earliest(self):
+        """Return earliest deadline, which might be stale, None if nothing is scheduled."""
+        with self.lock:
+            return self.heap[0][0] if self.heap else None
+
+    def due(self, now):
+        """Pop and return all items whose deadline has elapsed."""
+        items = []
+
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                deadline, __, item = heapq.heappop(self.heap)
+                # only the latest deadline of an item is valid.
+                if self.deadlines.get(item) == deadline:
+                    del self.deadlines[item]
+                    items.append(item)
+
+        return items
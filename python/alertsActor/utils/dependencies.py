@@ -0,0 +1,94 @@
+class InputCallback(object):
+    """Keyvar callback of an input keyword, caching its value in the alert logics reading it,
+    and re-evaluating their keys only if the value actually changed."""
+
+    def __init__(self, graph, inputId, keyVar):
+        self.graph = graph
+        self.inputId = inputId
+        self.keyVar = keyVar
+        self.alertLogics = set()
+        self.keys = set()
+        self.lastValue = None
+
+    def __str__(self):
+        return f'InputCallback({".".join(self.inputId)})'
+
+    def prime(self):
+        """Cache current value, without re-evaluating anything."""
+        self.lastValue = self.keyVar.getValue(doRaise=False)
+
+        for alertLogic in self.alertLogics:
+            alertLogic.setInput(self.inputId, self.lastValue)
+
+    def __call__(self, keyVar, newValue=True):
+        value = keyVar.getValue(doRaise=False)
+
+        if value == self.lastValue:
+            return
+
+        self.lastValue = value
+
+        for alertLogic in self.alertLogics:
+            alertLogic.setInput(self.inputId, value)
+
+        self.graph.reevaluate(self.keys)
+
+
+class DependencyGraph(object):
+    """Input keywords declared by the alert rules of a controller, and the keys depending on each of them."""
+
+    def __init__(self, actorRules):
+        self.actorRules = actorRules
+        self.inputCbs = dict()
+
+    @property
+    def logger(self):
+        return self.actorRules.logger
+
+    def rebuild(self):
+        """Rebuild the graph from the current alert logic of each key, called each time alerts logic is (re)loaded."""
+        self.clear()
+        models = self.actorRules.actor.models
+
+        for key in self.actorRules.allKeys():
+            for inputId in key.alertLogic.inputs or []:
+                modelName, keyName = inputId
+                # the rule is left to deal with models which are not loaded.
+                if modelName not in models:
+                    continue
+
+                if inputId not in self.inputCbs:
+                    self.inputCbs[inputId] = InputCallback(self, inputId, models[modelName].keyVarDict[keyName])
+
+                self.inputCbs[inputId].alertLogics.add(key.alertLogic)
+                self.inputCbs[inputId].keys.add(key)
+
+        for inputCb in self.inputCbs.values():
+            inputCb.prime()
+            inputCb.keyVar.addCallback(inputCb, callNow=False)
+            self.logger.warning('wiring in %s to %d key(s)', inputCb, len(inputCb.keys))
+
+    def clear(self):
+        """Remove all input callbacks."""
+        for inputCb in self.inputCbs.values():
+            inputCb.keyVar.removeCallback(inputCb)
+
+        self.inputCbs.clear()
+
+    def reevaluate(self, keys):
+        """Evaluate keys again right away, bypassing the unchanged value fast path."""
+        keyCallbacks = set()
+
+        for key in keys:
+            # never evaluated yet, keyword might not have been received, leave it to the startup grace period.
+            if key.transmitted is None:
+                continue
+
+            key.lastEvaluated = None
+            keyCallbacks.add(key.keyCB)
+
+        for cb in keyCallbacks:
+            try:
+                cb(self.actorRules.model[cb.keyVarName], newValue=False)
+            except Exception as e:
+                self.logger.exception('failed to re-evaluate %s.%s: %s', self.actorRules.name, cb.keyVarName, e)
@@ -0,0 +1,39 @@
+import numpy as np
+
+
+class KeyHistory(object):
+    """Preallocated ring buffers of the last evaluated timestamps, values and alert status codes of a key."""
+    __slots__ = ('timestamps', 'values', 'statuses', 'index', 'count')
+
+    def __init__(self, depth):
+        self.timestamps = np.zeros(depth, dtype='<i8')
+        self.values = np.zeros(depth, dtype='<f8')
+        self.statuses = np.zeros(depth, dtype='<i1')
+        # next slot to be written, and number of valid slots.
+        self.index = 0
+        self.count = 0
+
+    @property
+    def depth(self):
+        return len(self.timestamps)
+
+    def append(self, timestamp, value, status):
+        index = self.index
+        self.timestamps[index] = timestamp
+        self.values[index] = value
+        self.statuses[index] = status
+
+        self.index = (index + 1) % len(self.timestamps)
+        self.count = min(self.count + 1, len(self.timestamps))
+
+    def last(self, n=None):
+        """Return last n timestamps, values and statuses, oldest first."""
+        n = self.count if n is None else min(n, self.count)
+        rows = (self.index - n + np.arange(n)) % len(self.timestamps)
+
+        return self.timestamps[rows], self.values[rows], self.statuses[rows]
+
+    @staticmethod
+    def nTransitions(statuses):
+        """Number of alert status changes, to spot flapping."""
+        return int(np.count_nonzero(np.diff(statuses)))
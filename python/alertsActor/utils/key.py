@@ -1,12 +1,22 @@
+from functools import lru_cache
+
 import STSpy.STSpy.datum as stsDatum
-import alertsActor.utils.alertsFactory as alertsFactory
+import alertsActor.utils.clock as clock
 import ics.utils.time as pfsTime
 import opscore.protocols.types as types
+from alertsActor.utils.history import KeyHistory
 from ics.utils.fits import mhs as fitsMhs
 
 
+@lru_cache(maxsize=4096)
+def isoTimestamp(timestamp):
+    """Return ISO representation of a timestamp, many keywords share the same ones."""
+    return pfsTime.Time.fromtimestamp(timestamp).isoformat(microsecond=False)
+
+
 class MhsKey(object):
     """Encapsulate mhs value-types and conversion from it."""
+    __slots__ = ('keyId', 'keyName')
 
     def __init__(self, keyId, keyName):
         self.keyId = keyId
@@ -31,6 +41,7 @@ class MhsKey(object):
 
 class StsKey(object):
     """""Encapsulate STS value-types and conversion to it. """
+    __slots__ = ('stsType', 'stsId', 'stsHelp')
 
     def __init__(self, stsType, stsId, stsHelp, **kwargs):
         self.stsType = stsType
@@ -50,7 +61,7 @@ class StsKey(object):
             return None, None, None
 
         stsValue, stsText = datum.value
-        return pfsTime.Time.fromtimestamp(datum.timestamp).isoformat(microsecond=False), stsValue, f'"{stsText}"'
+        return isoTimestamp(datum.timestamp), stsValue, f'"{stsText}"'
 
     def build(self, timestamp, stsValue, stsText):
         def convert(stsType, stsValue):
@@ -73,24 +84,44 @@ class Key(object):
     EXPIRED_VALUE = dict([('FLOAT+TEXT', float(fitsMhs.EXPIRED)), ('INTEGER+TEXT', int(fitsMhs.EXPIRED))])
     INVALID_TEXT = 'invalid value !'
 
+    __slots__ = ('keyCB', 'mhsKey', 'stsKey', 'invalidCounter', 'transitions', '_transmitted', 'lastEvaluated',
+                 'alertLogic', 'alertConfig', 'stsDataRate', 'STS_DATA_RATE', 'TIMEOUT', 'allowInvalid', 'history')
+
     def __init__(self, keyCB, keyId, keyName, stsType, stsId, stsHelp, STS_DATA_RATE=0, **kwargs):
-        self.STS_DATA_RATE = keyCB.actorRules.actor.actorConfig['STS_DATA_RATE'] if not STS_DATA_RATE else STS_DATA_RATE
         self.keyCB = keyCB
+        # per-key STS data rate, if any.
+        self.stsDataRate = STS_DATA_RATE
+        self.history = None
+        self.loadConfig()
         self.mhsKey = MhsKey(keyId, keyName)
         self.stsKey = StsKey(stsType, stsId, stsHelp, **kwargs)
         # initialize invalid value counter
         self.invalidCounter = 0
         # initialize empty datum.
         self.transitions = dict([(False, None), (True, None)])
-        self.transmitted = None
+        self._transmitted = None
+        # last valid (rawValue, active, stsText) evaluated before timeout, used to skip unchanged values.
+        self.lastEvaluated = None
         # initialize alertLogic, eg simple monitoring.
-        self.alertLogic = alertsFactory.Monitoring(self.keyCB.actorRules)
+        self.alertLogic = self.keyCB.actorRules.monitoring(True)
+        # keywordAlerts rule the alertLogic has been built from, None if just monitoring.
+        self.alertConfig = None
 
     @property
     def actorKeyId(self):
         index = f'_{self.mhsKey.keyName}' if self.mhsKey.keyName else ''
         return f'{self.keyCB.actorRules.name}__{self.keyCB.keyVarName}{index}'
 
+    @property
+    def transmitted(self):
+        return self._transmitted
+
+    @transmitted.setter
+    def transmitted(self, datum):
+        """Record transmitted datum and keep track of triggered keys."""
+        self._transmitted = datum
+        self.keyCB.actorRules.setTriggered(self, self.triggered)
+
     @property
     def active(self):
         return self.alertLogic.activated
@@ -105,25 +136,47 @@ class Key(object):
         prevState = 'None' if self.transmitted is None else StsKey.getText(self.transmitted)
         return prevState
 
-    @property
-    def allowInvalid(self):
-        return self.keyCB.actorRules.actor.actorConfig['allowInvalid']
-
-    @property
-    def TIMEOUT(self):
-        return self.keyCB.actorRules.actor.actorConfig['TIMEOUT']
+    def loadConfig(self):
+        """Cache actor configuration values, called at construction and when alerts are reloaded."""
+        actorConfig = self.keyCB.actorRules.actor.actorConfig
+        self.STS_DATA_RATE = actorConfig['STS_DATA_RATE'] if not self.stsDataRate else self.stsDataRate
+        self.TIMEOUT = actorConfig['TIMEOUT']
+        self.allowInvalid = actorConfig['allowInvalid']
+        # history is opt-in, it is only reallocated if its depth changed.
+        historyDepth = actorConfig.get('historyDepth', 0)
+        if not historyDepth:
+            self.history = None
+        elif self.history is None or self.history.depth != historyDepth:
+            self.history = KeyHistory(historyDepth)
 
     def getCmd(self, cmd=None):
         """Return cmd object in anycase."""
         cmd = self.keyCB.actorRules.actor.bcast if cmd is None else cmd
         return cmd
 
-    def toStsDatum(self, timestamp, value, newValue=True):
-        """Convert timestamp and value to a valid alert-compliant STS datum."""
+    def isUnchanged(self, timestamp, value, now):
+        """Check if value and alert state are identical to the last evaluation and STS does not need a refresh."""
+        if self.lastEvaluated is None or self.transmitted is None or not self.alertLogic.isCacheable:
+            return False
+
+        lastValue, lastActive, lastText = self.lastEvaluated
+        if MhsKey.isInvalid(value) or (value, self.active) != (lastValue, lastActive):
+            return False
+
+        # the datum carrying that evaluation might have been lost, only STS acknowledged state counts.
+        if lastText != StsKey.getText(self.transmitted):
+            return False
+
+        # timeout and STS refresh still need to be handled by the regular path.
+        return now - timestamp < self.TIMEOUT and timestamp - self.transmitted.timestamp < self.STS_DATA_RATE
+
+    def toStsDatum(self, timestamp, value, newValue=True, withinLimits=None):
+        """Convert timestamp and value to a valid alert-compliant STS datum.
+        withinLimits is provided if limits have already been evaluated for that value."""
 
         def genTimeoutValueAndText(timestamp):
             # timestamp==0 if keyword never actually been updated.
-            datestr = pfsTime.Time.fromtimestamp(timestamp).isoformat(microsecond=False) if timestamp else "TRON START"
+            datestr = isoTimestamp(timestamp) if timestamp else "TRON START"
             return Key.EXPIRED_VALUE[self.stsKey.stsType], f'NO DATA SINCE {datestr}'
 
         def checkValue(rawValue):
@@ -139,53 +192,64 @@ class Key(object):
             # convert to a value that STS understand.
             stsValue = MhsKey.toStsValue(rawValue)
             # call alertLogic if any else OK.
-            stsText = self.alertLogic.call(rawValue)
+            if withinLimits is None:
+                stsText = self.alertLogic.call(rawValue)
+            else:
+                stsText = self.alertLogic.checkEvaluated(rawValue, withinLimits)
 
             return stsValue, stsText
 
-        now = pfsTime.timestamp()
+        now = clock.timestamp()
         # check value.
         stsValue, stsText = checkValue(value)
-        # override stsText if timedOut.
-        if now - timestamp > self.TIMEOUT:
+        isCached = not MhsKey.isInvalid(value)
+        # override stsText if timedOut, timed out right at the deadline, see KeyCallback.nextDeadline().
+        if now - timestamp >= self.TIMEOUT:
             stsValue, stsText = genTimeoutValueAndText(timestamp)
             timestamp = now
+            isCached = False
 
         # overriding by OK if alert is deactivated no matter what.
         if not self.active:
             stsText = 'OK'
 
+        self.lastEvaluated = (value, self.active, stsText) if isCached else None
+
         # convert to STS world.
         return self.stsKey.build(timestamp, stsValue, stsText)
 
-    def doTransmit(self, datum):
-        """Check if given datum needs to be transmitted to STS right away."""
+    def alertStatus(self, alertState):
+        """Get alert status from alert state, distinguish between OK, NO DATA and ALERT."""
+        if alertState == 'None':
+            status = -1
+        elif alertState == 'OK':
+            status = 0
+        elif alertState == Key.INVALID_TEXT:
+            # setting status to 1 if invalid counter is not above limit.
+            status = 1 if self.invalidCounter <= self.allowInvalid else 2
+        elif 'NO DATA SINCE' in alertState:
+            status = 3
+        else:
+            status = 4
+
+        return status
+
+    def doTransmit(self, datum, keywords=None):
+        """Check if given datum needs to be transmitted to STS right away.
+        If a keywords list is given, transition keywords are appended to it instead of being generated."""
 
         def doUpdateSTS(timestamp):
             """Check if STS value is now obsolete and needs update."""
             return timestamp - self.transmitted.timestamp >= self.STS_DATA_RATE
 
-        def alertStatus(alertState):
-            """Get alert status from alert state, distinguish between OK, NO DATA and ALERT."""
-            if alertState == 'None':
-                status = -1
-            elif alertState == 'OK':
-                status = 0
-            elif alertState == Key.INVALID_TEXT:
-                # setting status to 1 if invalid counter is not above limit.
-                status = 1 if self.invalidCounter <= self.allowInvalid else 2
-            elif 'NO DATA SINCE' in alertState:
-                status = 3
-            else:
-                status = 4
-
-            return status
-
         # lookup stsText
         newState = StsKey.getText(datum)
         # converting alertState to status.
-        newStatus = alertStatus(newState)
-        prevStatus = alertStatus(self.prevState)
+        newStatus = self.alertStatus(newState)
+        prevStatus = self.alertStatus(self.prevState)
+        # keep track of every evaluated datum.
+        if self.history is not None:
+            self.history.append(datum.timestamp, datum.value[0], newStatus)
         # value is invalid but below invalid limit, we do not transmit and wait for the next datum.
         if newStatus == 1:
             self.getCmd().warn(f'text="{self.actorKeyId} invalidCounter={self.invalidCounter}, ignoring for now...')
@@ -196,40 +260,78 @@ class Key(object):
         if statusChanged:
             # generate transition keyword corresponding to previous state.
             suffix = 'lastAlert' if newState == 'OK' else 'lastOK'
-            self.genKey(self.transitions[newState != 'OK'], suffix=f'_{suffix}')
+            transitionKey = self.datumKey(self.transitions[newState != 'OK'], suffix=f'_{suffix}')
+
+            if keywords is None:
+                self.getCmd().inform(transitionKey)
+            else:
+                keywords.append(transitionKey)
 
             self.transitions[newState == 'OK'] = datum
 
         # if stateChange or if the value needs to be refreshed. 
         return statusChanged or doUpdateSTS(datum.timestamp)
 
-    def setAlertLogic(self, alertLogic):
+    def restoreState(self, transmitted, lastOK, lastAlert, invalidCounter):
+        """Restore alert state from a snapshot."""
+        self.transitions[True] = lastOK
+        self.transitions[False] = lastAlert
+        self.invalidCounter = invalidCounter
+        self.transmitted = transmitted
+
+    def setAlertLogic(self, alertLogic, alertConfig=None):
         """Set a new alert logic to the key. note that history is always preserved."""
         self.alertLogic = alertLogic
+        self.alertConfig = alertConfig
+        self.lastEvaluated = None
         self.genAlertLogic()
 
     def resetAlertLogic(self, doActivate=True):
         """Declaring no alertLogic for that key."""
-        # just monitoring by default.
-        self.alertLogic = alertsFactory.Monitoring(self.keyCB.actorRules)
-        # alertLogic should always be activated by default, unless if force not to.
-        self.alertLogic.setActivated(doActivate)
+        # just monitoring by default, alertLogic should always be activated by default, unless if force not to.
+        self.alertLogic = self.keyCB.actorRules.monitoring(doActivate)
+        self.alertConfig = None
+        self.lastEvaluated = None
         self.genAlertLogic()
 
+    def alertLogicKey(self):
+        """Return alertLogic keyword."""
+        return f'{self.actorKeyId}_logic="{str(self.alertLogic)}"'
+
+    def datumKey(self, datum, suffix=''):
+        """Return alert keyword."""
+        return f'{self.actorKeyId}{suffix}={",".join(map(str, list(StsKey.repr(datum))))}'
+
+    def lastOkKey(self):
+        """Return last OK keyword."""
+        return self.datumKey(self.transitions[True])
+
+    def lastAlertKey(self):
+        """Return last Alert keyword."""
+        return self.datumKey(self.transitions[False])
+
+    def historyKey(self, n=None):
+        """Return history keyword: number of entries and of status changes, then timestamp,value,status triplets."""
+        timestamps, values, statuses = self.history.last(n)
+        fields = [str(len(timestamps)), str(KeyHistory.nTransitions(statuses))]
+
+        for timestamp, value, status in zip(timestamps.tolist(), values.tolist(), statuses.tolist()):
+            fields.append(f'{timestamp},{value:g},{status}')
+
+        return f'{self.actorKeyId}_history={",".join(fields)}'
+
     def genAlertLogic(self, cmd=None):
         """generate alertLogic keyword."""
-        self.getCmd(cmd).inform(f'{self.actorKeyId}_logic="{str(self.alertLogic)}"')
+        self.getCmd(cmd).inform(self.alertLogicKey())
 
     def genKey(self, datum, suffix='', cmd=None):
         """Generate alert keyword."""
-        self.getCmd(cmd).inform(f'{self.actorKeyId}{suffix}={",".join(map(str, list(StsKey.repr(datum))))}')
+        self.getCmd(cmd).inform(self.datumKey(datum, suffix=suffix))
 
     def genLastOk(self, cmd):
         """Generate last OK keyword."""
-        datum = self.transitions[True]
-        self.genKey(datum, cmd=cmd)
+        cmd.inform(self.lastOkKey())
 
     def genLastAlert(self, cmd):
         """Generate last Alert keyword."""
-        datum = self.transitions[False]
-        self.genKey(datum, cmd=cmd)
+        cmd.inform(self.lastAlertKey())
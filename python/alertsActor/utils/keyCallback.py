@@ -1,10 +1,11 @@
 from importlib import reload
 
-import STSpy.STSpy.radio as stsRadio
+import alertsActor.utils.clock as clock
 import alertsActor.utils.key as keyUtils
-import ics.utils.time as pfsTime
+import alertsActor.utils.limitsEvaluator as limitsEvaluator
 
 reload(keyUtils)
+reload(limitsEvaluator)
 
 
 class KeyCallback(object):
@@ -13,62 +14,148 @@ class KeyCallback(object):
     def __init__(self, actorRules, keyVarName, stsMaps):
         self.actorRules = actorRules
         self.keyVarName = keyVarName
-        self.keys = dict([(stsMap['keyId'], keyUtils.Key(self, **stsMap)) for stsMap in stsMaps])
+        self.stsMaps = dict()
+        self.keys = dict()
+        # vectorized limits evaluation, built along with alerts logic.
+        self.limitsEvaluator = None
+
+        self.update(stsMaps)
+
+    def update(self, stsMaps):
+        """(Re)build keys from STS config, keys whose config did not change are preserved.
+        Return removed and new keys."""
+        stsMaps = dict([(stsMap['keyId'], stsMap) for stsMap in stsMaps])
+        keys = dict()
+
+        for keyId, stsMap in stsMaps.items():
+            unchanged = keyId in self.keys and self.stsMaps[keyId] == stsMap
+            keys[keyId] = self.keys[keyId] if unchanged else keyUtils.Key(self, **stsMap)
+
+        removedKeys = [key for keyId, key in self.keys.items() if keys.get(keyId) is not key]
+        newKeys = [key for keyId, key in keys.items() if self.keys.get(keyId) is not key]
+
+        self.stsMaps = stsMaps
+        self.keys = keys
+        # indexes are only built at wiring time.
+        self.fromStsId = dict([(key.stsKey.stsId, key) for key in self.keys.values()])
+        self.fromKeyName = dict([(key.mhsKey.keyName, key) for key in self.keys.values()])
+        # timed out keys are refreshed as often as the fastest one.
+        self.refreshPeriod = min([key.STS_DATA_RATE for key in self.keys.values()])
+
+        return removedKeys, newKeys
 
     @property
     def logger(self):
         return self.actorRules.logger
 
     @property
-    def fromStsId(self):
-        return dict([(key.stsKey.stsId, key) for key in self.keys.values()])
-
-    @property
-    def fromKeyName(self):
-        return dict([(key.mhsKey.keyName, key) for key in self.keys.values()])
+    def metrics(self):
+        return self.actorRules.metrics
 
     def __call__(self, keyVar, newValue=True):
         """This function is called when new keys are received by the dispatcher. """
+        with self.metrics.timer('callback'):
+            self.process(keyVar, newValue=newValue)
+
+    def process(self, keyVar, newValue=True):
+        """Convert keyvar values to STS datums, check them against alerts logic and transmit them if necessary."""
         buffer = []
+        now = clock.timestamp()
 
         values = keyVar.getValue(doRaise=False)
         values = values if isinstance(values, tuple) else [values]
 
         # if keyvar is not genuine (eg not generated by the actor), the associated timestamp is not correct.
-        if not keyVar.isGenuine and (pfsTime.timestamp() - keyVar.timestamp) < self.actorRules.actor.actorConfig['STS_DATA_RATE']:
+        if not keyVar.isGenuine and (now - keyVar.timestamp) < self.actorRules.actor.actorConfig['STS_DATA_RATE']:
+            self.actorRules.scheduleTimeout(self, now + self.actorRules.actor.actorConfig['STS_DATA_RATE'])
             return
 
-        for keyId, key in self.keys.items():
+        # fast path, nothing to do if value and alert state did not change.
+        toEvaluate = [(keyId, key) for keyId, key in self.keys.items()
+                      if not key.isUnchanged(keyVar.timestamp, values[keyId], now)]
+        self.metrics.incr('updates', int(newValue))
+        self.metrics.incr('skipped', len(self.keys) - len(toEvaluate))
+        self.metrics.incr('built', len(toEvaluate))
+
+        # evaluate all limits at once if possible.
+        evaluated = self.limitsEvaluator.evaluate(values) if self.limitsEvaluator is not None and toEvaluate else dict()
+
+        # all keywords generated by that update are published at once.
+        keywords = []
+
+        for keyId, key in toEvaluate:
             # convert timestamp and value to a valid alert-compliant STS datum."""
-            datum = key.toStsDatum(keyVar.timestamp, values[keyId], newValue=newValue)
+            datum = key.toStsDatum(keyVar.timestamp, values[keyId], newValue=newValue,
+                                   withinLimits=evaluated.get(keyId, None))
+            # count invalid and timed out values.
+            if datum.value[0] == keyUtils.Key.INVALID_VALUE[key.stsKey.stsType]:
+                self.metrics.incr('invalid')
+            elif datum.value[0] == keyUtils.Key.EXPIRED_VALUE[key.stsKey.stsType]:
+                self.metrics.incr('timeouts')
             # assess whether it needs to be transmitted or not.
-            doSend = key.doTransmit(datum)
+            doSend = key.doTransmit(datum, keywords=keywords)
             # avoid filling logs unnecessarily.
             if newValue or doSend:
                 self.logger.debug('updating(doSend=%s) STSid %d(%s) from %s.%s[%s] with (%s, %s)',
                                   doSend, key.stsKey.stsId, key.stsKey.stsType, keyVar.actor, keyVar.name,
                                   keyId, datum.value[0], datum.value[1])
             if doSend:
-                key.genKey(datum)
+                keywords.append(key.datumKey(datum))
                 buffer.append(datum)
 
-        self.transmit(buffer, stsHost=self.actorRules.actor.stsHost)
+        if keywords:
+            self.actorRules.actor.bcast.inform('; '.join(keywords))
+
+        self.transmit(buffer)
+        self.actorRules.scheduleTimeout(self, self.nextDeadline(keyVar.timestamp, now))
+
+    def nextDeadline(self, timestamp, now):
+        """Return when that keyword needs to be evaluated again, either to detect a timeout or to refresh STS."""
+        timeoutAt = timestamp + self.actorRules.actor.actorConfig['TIMEOUT']
+
+        if timeoutAt > now:
+            return timeoutAt
+
+        # already timed out, NO DATA datums need to be refreshed.
+        return now + self.refreshPeriod
 
-    def transmit(self, buffer, stsHost):
-        """Transmit datum and clear buffer."""
+    def transmit(self, buffer):
+        """Queue datums to STS, this never blocks."""
         if not buffer:
             return
 
-        self.logger.debug('flushing STS (host=%s), with: %s', stsHost, buffer)
-        stsServer = stsRadio.Radio(host=stsHost)
-        stsServer.transmit(buffer)
+        stsSender = self.actorRules.actor.stsSender
+        self.logger.debug('flushing STS (%s), with: %s', stsSender, buffer)
+        stsSender.put(buffer, onSent=self.onTransmitted)
 
+    def onTransmitted(self, buffer):
+        """Called from the sender thread once datums have been acknowledged by STS."""
+        keysFromStsId = self.actorRules.actor.keysFromStsId
         # record transmitted datums.
         for datum in buffer:
-            self.fromStsId[datum.id].transmitted = datum
+            key = self.fromStsId.get(datum.id)
+            # key might have been unregistered (controller stopped, STS reloaded) while its datum was in flight.
+            if key is None or keysFromStsId.get(datum.id) is not key:
+                continue
+
+            key.transmitted = datum
+
+        self.metrics.incr('sent', len(buffer))
 
         # generate overall alertStatus keyword
-        self.actorRules.actor.genAlertStatus()
+        with self.metrics.timer('alertStatus'):
+            self.actorRules.actor.genAlertStatus()
+
+    def loadConfig(self):
+        """Reload cached configuration values of each key."""
+        for key in self.keys.values():
+            key.loadConfig()
+
+        self.refreshPeriod = min([key.STS_DATA_RATE for key in self.keys.values()])
+
+    def buildLimitsEvaluator(self):
+        """Pack limits of the current alerts logic, called each time alerts logic is (re)loaded."""
+        self.limitsEvaluator = limitsEvaluator.LimitsEvaluator.fromKeys(self.keys.values())
 
     def identify(self, identifier):
         """Return iterable of keys matching the given identifier. """
@@ -0,0 +1,43 @@
+import alertsActor.utils.alertsFactory as alertsFactory
+import numpy as np
+from alertsActor.utils.key import MhsKey
+
+
+class LimitsEvaluator(object):
+    """Pack the limits of all LimitsAlert-governed keys of a keyword into arrays, and evaluate them in one go.
+    Keys with a custom call= routine are left to their own logic."""
+    MIN_KEYS = 4
+
+    def __init__(self, keys):
+        self.keyIds = np.array([key.mhsKey.keyId for key in keys], dtype=int)
+        self.lowerLimit = np.array([key.alertLogic.lowerLimit for key in keys], dtype=float)
+        self.upperLimit = np.array([key.alertLogic.upperLimit for key in keys], dtype=float)
+        self.lowerBoundInclusive = np.array([key.alertLogic.lowerBoundInclusive for key in keys], dtype=bool)
+        self.upperBoundInclusive = np.array([key.alertLogic.upperBoundInclusive for key in keys], dtype=bool)
+
+    def __len__(self):
+        return len(self.keyIds)
+
+    @staticmethod
+    def isVectorizable(key):
+        return isinstance(key.alertLogic, alertsFactory.LimitsAlert) and not key.alertLogic.isCustom
+
+    @classmethod
+    def fromKeys(cls, keys):
+        """Return an evaluator if there is enough keys to make it worthwhile, None otherwise."""
+        keys = [key for key in keys if cls.isVectorizable(key)]
+        return cls(keys) if len(keys) >= cls.MIN_KEYS else None
+
+    def evaluate(self, values):
+        """Return withinLimits for each keyId, invalid values are evaluated as NaN and handled upstream.
+        If values cannot be packed, nothing is returned and keys fall back to their own logic."""
+        try:
+            values = np.array([np.nan if MhsKey.isInvalid(values[keyId]) else values[keyId] for keyId in self.keyIds],
+                              dtype=float)
+        except (TypeError, ValueError):
+            return dict()
+
+        lowerBoundOK = np.where(self.lowerBoundInclusive, values >= self.lowerLimit, values > self.lowerLimit)
+        upperBoundOK = np.where(self.upperBoundInclusive, values <= self.upperLimit, values < self.upperLimit)
+
+        return dict(zip(self.keyIds.tolist(), (lowerBoundOK & upperBoundOK).tolist()))
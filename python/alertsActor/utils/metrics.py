@@ -0,0 +1,95 @@
+import time
+
+
+class LatencyHistogram(object):
+    """Latency histogram with power-of-two microsecond buckets, cheap enough to be always on."""
+    NBUCKETS = 32
+
+    def __init__(self):
+        self.buckets = [0] * LatencyHistogram.NBUCKETS
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def record(self, seconds):
+        """Record one measurement."""
+        iBucket = min(int(seconds * 1e6).bit_length(), LatencyHistogram.NBUCKETS - 1)
+        self.buckets[iBucket] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q):
+        """Return upper bound of the bucket containing that percentile, in seconds."""
+        if not self.count:
+            return 0.
+
+        threshold = q / 100 * self.count
+        cumulated = 0
+
+        for iBucket, count in enumerate(self.buckets):
+            cumulated += count
+            if cumulated >= threshold:
+                return min(2 ** iBucket * 1e-6, self.max)
+
+        return self.max
+
+    def merge(self, other):
+        """Add measurements of another histogram to this one."""
+        self.buckets = [count + otherCount for count, otherCount in zip(self.buckets, other.buckets)]
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        return self
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.
+
+    def values(self):
+        """Return count, mean, p50, p99 and max, in milliseconds."""
+        return [self.count] + [round(value * 1e3, 3) for value in (self.mean, self.percentile(50),
+                                                                  self.percentile(99), self.max)]
+
+
+class Timer(object):
+    """Context manager recording elapsed time in a LatencyHistogram."""
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.histogram.record(time.perf_counter() - self.start)
+
+
+class Metrics(object):
+    """Per-controller counters and latency histograms of the alerts pipeline."""
+    COUNTERS = ['updates', 'built', 'sent', 'skipped', 'invalid', 'timeouts']
+    HISTOGRAMS = ['callback', 'alertStatus']
+
+    def __init__(self):
+        self.counters = dict([(name, 0) for name in Metrics.COUNTERS])
+        self.histograms = dict([(name, LatencyHistogram()) for name in Metrics.HISTOGRAMS])
+
+    def incr(self, name, n=1):
+        self.counters[name] += n
+
+    def timer(self, name):
+        """Return a context manager timing the enclosed block."""
+        return Timer(self.histograms[name])
+
+    def keyValues(self):
+        """Return counters, followed by count, mean, p50, p99 and max latencies in ms for each histogram."""
+        values = [self.counters[name] for name in Metrics.COUNTERS]
+
+        for name in Metrics.HISTOGRAMS:
+            values.extend(self.histograms[name].values())
+
+        return values
+
+    def genKey(self, name):
+        return f'{name}_metrics={",".join(map(str, self.keyValues()))}'
@@ -0,0 +1,327 @@
+import gzip
+import importlib
+import json
+import logging
+import time
+
+import STSpy.STSpy.radio as stsRadio
+import alertsActor.utils.clock as clock
+from alertsActor.utils import sts as stsUtils
+from alertsActor.utils.metrics import LatencyHistogram, Timer
+
+
+class String(str):
+    """Stand-in for opscore String values, which are not transmitted as is to STS."""
+
+
+class Enum(str):
+    """Stand-in for opscore Enum values, transmitted to STS as their storage value.
+    Named after opscore Enum, see MhsKey.toStsValue()."""
+
+    def __new__(cls, value, storageValue):
+        enum = str.__new__(cls, value)
+        enum.storage = storageValue
+        return enum
+
+    def storageValue(self):
+        return self.storage
+
+
+def fromCaptured(value):
+    """Return keyvar value from a captured one, enum values being captured as {"enum": value, "storage": storage}."""
+    if isinstance(value, dict):
+        return Enum(value['enum'], value['storage'])
+    elif isinstance(value, str):
+        return String(value)
+
+    return value
+
+
+def toCaptured(value):
+    """Return json-compliant captured value, the storage value of enums is kept."""
+    if type(value).__name__ == 'Enum':
+        return dict(enum=str(value), storage=value.storageValue())
+    elif isinstance(value, str):
+        return str(value)
+
+    return value
+
+
+class Unset(tuple):
+    """Values of a keyvar which has never been updated, every field is invalid."""
+
+    def __getitem__(self, index):
+        return None
+
+
+class FakeClock(object):
+    """Clock only moving when told to."""
+
+    def __init__(self, now=0.):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class FakeKeyVar(object):
+    """Minimal opscore KeyVar, updated by hand."""
+
+    def __init__(self, actor, name):
+        self.actor = actor
+        self.name = name
+        self.values = None
+        self.timestamp = 0
+        self.isGenuine = True
+        self.callbacks = []
+        self.nErrors = 0
+
+    def __str__(self):
+        return f'FakeKeyVar({self.actor}.{self.name})'
+
+    def getValue(self, doRaise=True):
+        if self.values is None or (doRaise and None in self.values):
+            if doRaise:
+                raise ValueError(f'{self.actor}.{self.name} has no valid value')
+            return Unset()
+
+        return self.values[0] if len(self.values) == 1 else self.values
+
+    def addCallback(self, callFunc, callNow=True):
+        self.callbacks.append(callFunc)
+        if callNow:
+            callFunc(self)
+
+    def removeCallback(self, callFunc, doRaise=True):
+        try:
+            self.callbacks.remove(callFunc)
+        except ValueError:
+            if doRaise:
+                raise
+
+    def set(self, values, timestamp):
+        """Set new values and call callbacks, as the dispatcher would."""
+        self.values = tuple([fromCaptured(value) for value in values])
+        self.timestamp = timestamp
+
+        for callFunc in list(self.callbacks):
+            # like the dispatcher, a failing callback does not prevent the others from being called.
+            try:
+                callFunc(self)
+            except Exception as e:
+                self.nErrors += 1
+                logging.getLogger('alerts').warning('%s callback %s failed: %s', self, callFunc, e)
+
+
+class FakeModel(object):
+    """Minimal opscore Model, keyvars are created on first access."""
+
+    class KeyVarDict(dict):
+        def __init__(self, actor):
+            dict.__init__(self)
+            self.actor = actor
+
+        def __missing__(self, name):
+            keyVar = FakeKeyVar(self.actor, name)
+            self[name] = keyVar
+            return keyVar
+
+    def __init__(self, actor):
+        self.actor = actor
+        self.keyVarDict = FakeModel.KeyVarDict(actor)
+
+
+class RecordingCmd(object):
+    """Stand-in for actor.bcast, counting generated replies and optionally writing them to a file."""
+
+    def __init__(self, output=None):
+        self.output = output
+        self.counts = dict(debug=0, inform=0, warn=0, fail=0, finish=0)
+
+    def reply(self, level, text):
+        self.counts[level] += 1
+        if self.output is not None:
+            self.output.write(f'{clock.timestamp():.3f} {level} {text}\n')
+
+    def debug(self, text=''):
+        self.reply('debug', text)
+
+    def inform(self, text=''):
+        self.reply('inform', text)
+
+    def warn(self, text=''):
+        self.reply('warn', text)
+
+    def fail(self, text=''):
+        self.reply('fail', text)
+
+    def finish(self, text=''):
+        self.reply('finish', text)
+
+
+class RecordingSender(object):
+    """Stand-in for StsSender, acknowledging datums right away.
+    Alert transitions are tracked per stsId, and datums optionally written to a file."""
+
+    def __init__(self, keysFromStsId, output=None):
+        self.keysFromStsId = keysFromStsId
+        self.output = output
+        self.nDatums = 0
+        self.nBytes = 0
+        self.lastText = dict()
+        self.transitions = []
+
+    def __str__(self):
+        return f'RecordingSender(datums={self.nDatums}, bytes={self.nBytes})'
+
+    def put(self, datums, onSent=None):
+        self.nDatums += len(datums)
+        self.nBytes += sum([len(stsRadio.Radio.pack(datum)) for datum in datums])
+
+        for datum in datums:
+            stsValue, stsText = datum.value
+            prevText = self.lastText.get(datum.id)
+
+            if (prevText == 'OK') != (stsText == 'OK'):
+                key = self.keysFromStsId.get(datum.id)
+                actorKeyId = key.actorKeyId if key is not None else ''
+                self.transitions.append((datum.timestamp, datum.id, actorKeyId, prevText, stsText))
+
+            self.lastText[datum.id] = stsText
+
+            if self.output is not None:
+                self.output.write(f'{datum.timestamp},{datum.id},{stsValue},"{stsText}"\n')
+
+        if onSent is not None:
+            onSent(datums)
+
+    def genMetricsKey(self):
+        return f'stsSender_metrics={self.nDatums},{self.nBytes}'
+
+
+class OfflineActor(object):
+    """Just enough of the alerts actor to run controllers without hub, STS or threads.
+    Time is driven by the replayed updates, and controllers timeouts are checked every tickPeriod."""
+    DEFAULT_CONFIG = dict(STS_DATA_RATE=60, TIMEOUT=600, allowInvalid=0)
+
+    def __init__(self, actorConfig=None, localConfig=None, stsSender=None, tickPeriod=1, output=None):
+        self.actorConfig = dict(OfflineActor.DEFAULT_CONFIG, **(actorConfig if actorConfig else dict()))
+        self.localConfig = localConfig if localConfig else dict()
+        self.logger = logging.getLogger('alerts')
+        self.bcast = RecordingCmd(output=output)
+        self.models = dict()
+        self.controllers = dict()
+        self.triggeredKeys = set()
+        self.keysFromStsId = dict()
+        self.snapshot = None
+        self.snapshotPeriod = float('inf')
+        self.stsSender = RecordingSender(self.keysFromStsId) if stsSender is None else stsSender
+
+        self.clock = FakeClock()
+        self.tickPeriod = tickPeriod
+        self.nextTick = None
+        self.alertStatusChanges = []
+        # per-stage timing.
+        self.latencies = dict(update=LatencyHistogram(), timeout=LatencyHistogram())
+        self.nUpdates = 0
+
+    @property
+    def alertStatus(self):
+        return 'ALERT' if self.triggeredKeys else 'OK'
+
+    @property
+    def alertStatusKey(self):
+        return f'alertStatus={self.alertStatus}'
+
+    def genAlertStatus(self, cmd=None):
+        """Only track alertStatus changes."""
+        alertStatus = self.alertStatus
+        if not self.alertStatusChanges or self.alertStatusChanges[-1][1] != alertStatus:
+            self.alertStatusChanges.append((self.clock.now, alertStatus))
+
+    def addModels(self, modelNames):
+        for modelName in modelNames:
+            if modelName not in self.models:
+                self.models[modelName] = FakeModel(modelName)
+
+    def attachControllers(self, modelNames, startTime):
+        """Set the clock and wire controllers for the given models, as connectionMade() would do."""
+        clock.setClock(self.clock)
+        self.clock.now = startTime
+        self.nextTick = startTime
+        # all models are loaded first, as rules can read other models.
+        self.addModels(modelNames)
+
+        for modelName in modelNames:
+            controllerName, name = stsUtils.controllerFromModel(modelName)
+            module = importlib.import_module(f'alertsActor.Controllers.{controllerName}')
+            ctrl = getattr(module, controllerName)(self, name)
+            self.controllers[name] = ctrl
+            ctrl.wire(self.bcast)
+
+        self.genAlertStatus()
+
+    def detachControllers(self):
+        """Unwire controllers and go back to wall clock time."""
+        for name, ctrl in list(self.controllers.items()):
+            ctrl.stop(self.bcast)
+
+        clock.resetClock()
+
+    def advance(self, timestamp):
+        """Move the clock forward, checking timeouts as the controllers threads would do in the meantime."""
+        while self.nextTick <= timestamp:
+            self.clock.now = self.nextTick
+
+            with Timer(self.latencies['timeout']):
+                for ctrl in self.controllers.values():
+                    ctrl.handleTimeout()
+
+            self.nextTick += self.tickPeriod
+
+        self.clock.now = max(self.clock.now, timestamp)
+
+    def update(self, timestamp, actor, keyName, values):
+        """Replay a single keyvar update."""
+        self.advance(timestamp)
+
+        # updates from models which are not wired are just ignored.
+        if actor not in self.models:
+            return
+
+        self.nUpdates += 1
+
+        with Timer(self.latencies['update']):
+            self.models[actor].keyVarDict[keyName].set(values, timestamp)
+
+    def replay(self, updates):
+        """Replay all updates, return elapsed wall time."""
+        start = time.perf_counter()
+
+        for timestamp, actor, keyName, values in updates:
+            self.update(timestamp, actor, keyName, values)
+
+        return time.perf_counter() - start
+
+
+def openCapture(filepath, mode='r'):
+    """Open a capture file, gzipped if the name says so."""
+    return gzip.open(filepath, f'{mode}t') if filepath.endswith('.gz') else open(filepath, mode)
+
+
+def readCapture(filepath):
+    """Iterate over (timestamp, actor, keyName, values) from a capture file.
+    A capture file is made of one json list per line, ordered by timestamp.
+    Strings are plain json strings, enums are {"enum": value, "storage": storageValue} objects."""
+    with openCapture(filepath, 'r') as captureFile:
+        for line in captureFile:
+            if line.strip():
+                timestamp, actor, keyName, values = json.loads(line)
+                yield timestamp, actor, keyName, values
+
+
+def writeCapture(filepath, updates):
+    """Write (timestamp, actor, keyName, values) updates to a capture file."""
+    with openCapture(filepath, 'w') as captureFile:
+        for timestamp, actor, keyName, values in updates:
+            captureFile.write(json.dumps([timestamp, actor, keyName, [toCaptured(value) for value in values]]) + '\n')
@@ -0,0 +1,219 @@
+import collections
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+
+from twisted.internet import reactor
+
+# from python 3.12, a single profile can be active at a time, but it records all threads.
+PER_THREAD_PROFILES = sys.version_info < (3, 12)
+
+
+class StackSampler(threading.Thread):
+    """Periodically sample the stacks of all other threads, collapsed for flamegraphs."""
+
+    def __init__(self, interval=0.01):
+        threading.Thread.__init__(self, name='stackSampler', daemon=True)
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.exitASAP = threading.Event()
+
+    def run(self):
+        threadNames = dict()
+
+        while not self.exitASAP.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == self.ident:
+                    continue
+                if ident not in threadNames:
+                    threadNames = dict([(thread.ident, thread.name) for thread in threading.enumerate()])
+
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                    frame = frame.f_back
+
+                self.stacks[';'.join([threadNames.get(ident, str(ident))] + stack[::-1])] += 1
+
+    def stop(self):
+        self.exitASAP.set()
+        self.join()
+
+    def dump(self, filepath):
+        with open(filepath, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+class ActorProfiler(object):
+    """Profile the reactor thread and all controller threads.
+    Before python 3.12, cProfile only traces the thread it is enabled from, so each controller enables/disables its own
+    profile. From python 3.12, the reactor profile records all threads."""
+
+    def __init__(self, actor, outputDir):
+        self.actor = actor
+        self.outputDir = outputDir
+        self.profiles = dict()
+        # threads whose profile could not be enabled.
+        self.unprofiled = set()
+        # controller threads being profiled, and the ones which did not report their profile stopped yet.
+        self.threads = set()
+        self.pending = set()
+        self.sampler = None
+        self.startedAt = None
+        self.autoStop = None
+        # stop deadline, and command to report to, while waiting for the controller threads.
+        self.stopDeadline = None
+        self.stopCmd = None
+
+    @property
+    def isRunning(self):
+        return self.startedAt is not None
+
+    @property
+    def isStopping(self):
+        return self.stopDeadline is not None
+
+    def start(self, duration=None, doSample=False):
+        """Start profiling, must be called from the reactor thread."""
+        if self.isRunning:
+            raise RuntimeError('profiler is already running')
+
+        self.profiles.clear()
+        self.unprofiled.clear()
+        self.threads.clear()
+
+        self.enableInThread('reactor')
+        if 'reactor' not in self.profiles:
+            raise RuntimeError('reactor could not be profiled, another profiling tool is active')
+
+        self.startedAt = time.time()
+
+        if PER_THREAD_PROFILES:
+            for name, ctrl in self.actor.controllers.items():
+                self.threads.add(name)
+                ctrl.putMsg(self.enableInThread, name)
+
+        if doSample:
+            self.sampler = StackSampler()
+            self.sampler.start()
+
+        if duration is not None:
+            self.autoStop = reactor.callLater(duration, self.stop)
+
+    def enableInThread(self, name):
+        profile = cProfile.Profile()
+
+        try:
+            profile.enable()
+        except ValueError as e:
+            # another profiling tool is already active in that thread.
+            self.actor.logger.warning('%s could not be profiled: %s', name, e)
+            self.unprofiled.add(name)
+            return
+
+        self.profiles[name] = profile
+
+    def disableInThread(self, name):
+        # messages are processed in order, so the profile was enabled by now, if it could be.
+        profile = self.profiles.get(name)
+        if profile is not None:
+            profile.disable()
+
+        reactor.callFromThread(self.onStopped, name)
+
+    def onStopped(self, name):
+        """Called in the reactor thread once a controller thread stopped its profile."""
+        # too late, that profile has already been ignored.
+        if name not in self.pending:
+            return
+
+        self.pending.discard(name)
+
+        if not self.pending:
+            self.stopDeadline.cancel()
+            self.finish()
+
+    def stop(self, cmd=None, timeout=5):
+        """Stop profiling, must be called from the reactor thread which is never blocked.
+        Controller threads report back asynchronously, stats are dumped and reported to cmd once they all did,
+        or once timeout expired. cmd is finished then, if given."""
+        if not self.isRunning:
+            raise RuntimeError('profiler is not running')
+        if self.isStopping:
+            raise RuntimeError('profiler is already stopping')
+
+        if self.autoStop is not None and self.autoStop.active():
+            self.autoStop.cancel()
+        self.autoStop = None
+
+        self.stopCmd = cmd
+        self.profiles['reactor'].disable()
+        self.pending = set([name for name in self.threads if name in self.actor.controllers])
+        self.stopDeadline = reactor.callLater(timeout, self.finish)
+
+        for name in self.pending:
+            self.actor.controllers[name].putMsg(self.disableInThread, name)
+
+        if not self.pending:
+            self.stopDeadline.cancel()
+            self.finish()
+
+    def finish(self):
+        """Dump stats of the stopped profiles and report them."""
+        for name in self.pending:
+            self.actor.logger.warning('%s profile could not be stopped, ignoring it', name)
+            self.profiles.pop(name, None)
+
+        cmd = self.stopCmd
+        self.pending = set()
+        self.stopDeadline = None
+        self.stopCmd = None
+
+        prefix = os.path.join(self.outputDir, f'alerts-{time.strftime("%Y%m%dT%H%M%S", time.gmtime(self.startedAt))}')
+        self.startedAt = None
+        outputs = [f'{prefix}.prof']
+
+        # sampler needs to be stopped no matter what, it would keep running for good otherwise.
+        sampler, self.sampler = self.sampler, None
+        if sampler is not None:
+            sampler.stop()
+
+        try:
+            os.makedirs(self.outputDir, exist_ok=True)
+            stats = pstats.Stats(*self.profiles.values())
+            stats.dump_stats(f'{prefix}.prof')
+
+            if sampler is not None:
+                sampler.dump(f'{prefix}.collapsed')
+                outputs.append(f'{prefix}.collapsed')
+        except Exception as e:
+            # nothing would report it otherwise, this is not called from a command anymore.
+            self.actor.logger.warning('failed to dump profile: %s', e)
+            if cmd is not None:
+                cmd.fail(f'text="failed to dump profile: {e}"')
+            return
+
+        self.report(stats, outputs, cmd=cmd)
+
+        if cmd is not None:
+            cmd.finish()
+
+    def report(self, stats, outputs, cmd=None, nTop=20):
+        """Generate keywords for the top entries by cumulative time."""
+        cmd = self.actor.bcast if cmd is None else cmd
+
+        entries = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+
+        for rank, ((filename, lineno, funcname), (cc, nc, tt, ct, callers)) in enumerate(entries[:nTop]):
+            cmd.inform(f'profileEntry={rank},{nc},{tt:.6f},{ct:.6f},'
+                       f'"{os.path.basename(filename)}:{lineno}({funcname})"')
+
+        cmd.inform(f'text="profile dumped to {",".join(outputs)}"')
+
+        if self.unprofiled:
+            cmd.warn(f'text="not profiled: {",".join(sorted(self.unprofiled))}"')
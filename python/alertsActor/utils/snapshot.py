@@ -0,0 +1,62 @@
+import os
+import sqlite3
+
+from alertsActor.utils.stsSpool import packDatum, unpackDatum
+
+
+def toBlob(datum):
+    return None if datum is None else packDatum(datum)
+
+
+def fromBlob(blob):
+    return None if blob is None else unpackDatum(blob)[0]
+
+
+class StateSnapshot(object):
+    """SQLite snapshot of the alert state of each key: last transmitted datum, transitions and invalid counter.
+    A connection is opened per call, so it can be used from any controller thread."""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        with self.connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS keys (stsId INTEGER PRIMARY KEY, actorKeyId TEXT, '
+                         'transmitted BLOB, lastOK BLOB, lastAlert BLOB, invalidCounter INTEGER)')
+
+    def __str__(self):
+        return f'StateSnapshot(path={self.path})'
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def save(self, keys):
+        """Save state of the given keys."""
+        rows = [(key.stsKey.stsId, key.actorKeyId, toBlob(key.transmitted), toBlob(key.transitions[True]),
+                 toBlob(key.transitions[False]), key.invalidCounter) for key in keys]
+
+        with self.connect() as conn:
+            conn.executemany('INSERT OR REPLACE INTO keys VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    def load(self, keys):
+        """Restore state of the given keys, return the number of restored keys."""
+        keys = dict([(key.stsKey.stsId, key) for key in keys])
+        if not keys:
+            return 0
+
+        with self.connect() as conn:
+            rows = conn.execute(f'SELECT * FROM keys WHERE stsId IN ({",".join("?" * len(keys))})',
+                                list(keys)).fetchall()
+
+        nRestored = 0
+
+        for stsId, actorKeyId, transmitted, lastOK, lastAlert, invalidCounter in rows:
+            key = keys[stsId]
+            # stsId might have been wired to another keyword since.
+            if key.actorKeyId != actorKeyId:
+                continue
+
+            key.restoreState(fromBlob(transmitted), fromBlob(lastOK), fromBlob(lastAlert), invalidCounter)
+            nRestored += 1
+
+        return nRestored
@@ -119,6 +119,19 @@ def parseAlertsModels(parts, cmd=None):
     return stsModels
 
 
+def controllerFromModel(modelName):
+    """Return controller module and controller name for a given alerts model.
+
+    Rough actor names should be normalized to rough_N, but roughN is also accepted.
+    """
+    if '_' in modelName:
+        return modelName.split('_')[0], modelName
+    elif modelName[-1].isdigit():
+        return modelName[:-1], modelName
+
+    return modelName, modelName
+
+
 def stsIdFromModel(cmd, model, stsPrimaryId):
     """
     For a given actorkeys model, return a list of all the STS ids listed therein.
@@ -0,0 +1,316 @@
+import argparse
+import datetime
+import glob
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+# one file per column, fixed-width so they can be memory-mapped.
+COLUMNS = dict(stsId='<i4', timestamp='<i8', value='<f8', textId='<i4')
+
+
+def parseTime(value):
+    """Return unix timestamp from a unix timestamp or an ISO date string."""
+    if value is None:
+        return None
+
+    try:
+        return float(value)
+    except ValueError:
+        date = datetime.datetime.fromisoformat(value)
+
+    # dates are UTC, unless an offset is given.
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+
+    return date.timestamp()
+
+
+class Partition(object):
+    """All datums whose timestamp falls within a partition period, stored as columns.
+    Alert texts are dictionary-encoded, and an stsId index is rebuilt as rows are appended and when the partition
+    is closed. Rows appended since the index was built are scanned."""
+
+    def __init__(self, path, doWrite=False, reindexRows=100000):
+        self.path = path
+        self.doWrite = doWrite
+        self.reindexRows = reindexRows
+        self.files = dict()
+
+        if doWrite:
+            os.makedirs(path, exist_ok=True)
+
+        self.texts = self.loadTexts()
+        self.textIds = dict([(text, textId) for textId, text in enumerate(self.texts)])
+
+        if doWrite:
+            # columns might not be aligned after a crash, only complete rows are kept.
+            nRows = self.nRows
+            for name, dtype in COLUMNS.items():
+                filepath = self.filepath(name)
+                with open(filepath, 'ab') as f:
+                    f.truncate(nRows * np.dtype(dtype).itemsize)
+                self.files[name] = open(filepath, 'ab')
+
+            self.files['texts'] = open(os.path.join(path, 'texts.jsonl'), 'a')
+            self.nIndexed = int(self.readIndex()[1][-1])
+            self.nUnindexed = nRows - self.nIndexed
+
+    def filepath(self, name):
+        return os.path.join(self.path, f'{name}.col')
+
+    @property
+    def nRows(self):
+        """Number of complete rows."""
+        sizes = []
+
+        for name, dtype in COLUMNS.items():
+            try:
+                sizes.append(os.path.getsize(self.filepath(name)) // np.dtype(dtype).itemsize)
+            except OSError:
+                sizes.append(0)
+
+        return min(sizes)
+
+    def loadTexts(self):
+        try:
+            with open(os.path.join(self.path, 'texts.jsonl'), 'r') as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except OSError:
+            return []
+
+    def textId(self, text):
+        """Return id of that text, adding it to the dictionary if necessary."""
+        try:
+            return self.textIds[text]
+        except KeyError:
+            textId = len(self.texts)
+            self.texts.append(text)
+            self.textIds[text] = textId
+            self.files['texts'].write(json.dumps(text) + '\n')
+            return textId
+
+    def append(self, datums):
+        """Append datums to the columns, texts come first so rows always refer to a known text."""
+        textIds = [self.textId(datum.value[1]) for datum in datums]
+        self.files['texts'].flush()
+
+        columns = dict(stsId=[datum.id for datum in datums],
+                       timestamp=[datum.timestamp for datum in datums],
+                       value=[datum.value[0] for datum in datums],
+                       textId=textIds)
+
+        for name, dtype in COLUMNS.items():
+            self.files[name].write(np.array(columns[name], dtype=dtype).tobytes())
+            self.files[name].flush()
+
+        self.nUnindexed += len(datums)
+
+        # a quarter of the indexed rows at least, so rebuilding stays cheap on large partitions.
+        if self.nUnindexed >= max(self.reindexRows, self.nIndexed // 4):
+            self.buildIndex()
+
+    def column(self, name, nRows):
+        """Return memory-mapped column."""
+        if not nRows:
+            return np.zeros(0, dtype=COLUMNS[name])
+
+        return np.memmap(self.filepath(name), dtype=COLUMNS[name], mode='r', shape=(nRows,))
+
+    def buildIndex(self):
+        """Index rows by stsId, in a single file so it is replaced atomically:
+        number of stsIds, sorted unique stsIds, offsets in rows, and rows ordered by stsId."""
+        nRows = self.nRows
+        stsIds = np.array(self.column('stsId', nRows))
+        rows = np.argsort(stsIds, kind='stable')
+        ids, offsets = np.unique(stsIds[rows], return_index=True)
+        index = np.concatenate([[len(ids)], ids, offsets, [nRows], rows]).astype('<i8')
+
+        tmpPath = os.path.join(self.path, 'index.tmp.npy')
+        np.save(tmpPath, index)
+        os.replace(tmpPath, os.path.join(self.path, 'index.npy'))
+
+        self.nIndexed = nRows
+        self.nUnindexed = 0
+
+    def readIndex(self):
+        """Return sorted unique stsIds, offsets in rows, and rows ordered by stsId, the last offset being the
+        number of indexed rows."""
+        try:
+            index = np.load(os.path.join(self.path, 'index.npy'), mmap_mode='r')
+        except OSError:
+            return np.zeros(0, dtype='<i8'), np.zeros(1, dtype='<i8'), np.zeros(0, dtype='<i8')
+
+        nIds = int(index[0])
+        return index[1:nIds + 1], index[nIds + 1:2 * nIds + 2], index[2 * nIds + 2:]
+
+    def lookup(self, stsId, nRows):
+        """Return rows of that stsId, using the index and only scanning rows appended since it was built."""
+        ids, offsets, indexedRows = self.readIndex()
+
+        nIndexed = int(offsets[-1])
+        iId = np.searchsorted(ids, stsId)
+        found = iId < len(ids) and ids[iId] == stsId
+        rows = np.array(indexedRows[offsets[iId]:offsets[iId + 1]]) if found else np.zeros(0, dtype='<i8')
+
+        if nRows > nIndexed:
+            tail = self.column('stsId', nRows)[nIndexed:]
+            rows = np.concatenate([rows, np.flatnonzero(tail == stsId) + nIndexed])
+
+        return rows
+
+    def query(self, stsId, start=None, end=None):
+        """Return (timestamp, value, text) of that stsId between start and end."""
+        nRows = self.nRows
+        rows = self.lookup(stsId, nRows)
+
+        timestamps = self.column('timestamp', nRows)[rows]
+        selected = np.ones(len(rows), dtype=bool)
+        if start is not None:
+            selected &= timestamps >= start
+        if end is not None:
+            selected &= timestamps <= end
+
+        rows = rows[selected]
+        values = self.column('value', nRows)[rows]
+        textIds = self.column('textId', nRows)[rows]
+        texts = self.texts if len(self.texts) > textIds.max(initial=-1) else self.loadTexts()
+
+        return [(int(timestamp), float(value), texts[textId])
+                for timestamp, value, textId in zip(timestamps[selected], values, textIds)]
+
+    def close(self, doIndex=True):
+        for f in self.files.values():
+            f.close()
+
+        self.files.clear()
+
+        if doIndex and self.doWrite and self.nUnindexed:
+            self.buildIndex()
+
+
+class StsArchive(object):
+    """Columnar archive of the datums acknowledged by STS, partitioned by datum timestamp.
+    Datums are appended from the sender thread, queries can be run from anywhere, including another process."""
+
+    def __init__(self, path, partitionPeriod=86400, maxOpen=2, reindexRows=100000, doIndex=True):
+        self.path = path
+        self.partitionPeriod = partitionPeriod
+        self.maxOpen = maxOpen
+        self.reindexRows = reindexRows
+        self.partitions = dict()
+        self.nArchived = 0
+        # append() is called from the sender thread, close() possibly from the reactor.
+        self.lock = threading.Lock()
+
+        os.makedirs(path, exist_ok=True)
+
+        if doIndex:
+            self.indexPartitions()
+
+    def __str__(self):
+        return f'StsArchive(path={self.path}, archived={self.nArchived})'
+
+    def partitionStart(self, timestamp):
+        return int(timestamp // self.partitionPeriod * self.partitionPeriod)
+
+    def partitionPath(self, partitionStart):
+        return os.path.join(self.path, f'{partitionStart:012d}')
+
+    def getPartition(self, partitionStart):
+        """Return partition opened for writing, most recent ones are kept open."""
+        try:
+            return self.partitions[partitionStart]
+        except KeyError:
+            pass
+
+        # old datums can still be replayed from the spool, just close the oldest partition.
+        if len(self.partitions) >= self.maxOpen:
+            self.partitions.pop(min(self.partitions)).close()
+
+        # partitions left open are not expected to grow much anymore, index them now.
+        for partition in self.partitions.values():
+            if partition.nUnindexed:
+                partition.buildIndex()
+
+        partition = Partition(self.partitionPath(partitionStart), doWrite=True, reindexRows=self.reindexRows)
+        self.partitions[partitionStart] = partition
+        return partition
+
+    def indexPartitions(self):
+        """Index existing partitions which were not, or only partially, eg if the actor was killed.
+        The current partition is left alone, it is indexed as it grows."""
+        current = self.partitionStart(time.time())
+
+        for partitionStart in self.listPartitions():
+            if partitionStart == current:
+                continue
+
+            partition = Partition(self.partitionPath(partitionStart))
+            if partition.readIndex()[1][-1] < partition.nRows:
+                partition.buildIndex()
+
+    def append(self, datums):
+        """Archive datums, which are usually all within the same partition."""
+        byPartition = dict()
+
+        for datum in datums:
+            byPartition.setdefault(self.partitionStart(datum.timestamp), []).append(datum)
+
+        with self.lock:
+            for partitionStart, partitionDatums in byPartition.items():
+                self.getPartition(partitionStart).append(partitionDatums)
+
+        self.nArchived += len(datums)
+
+    def listPartitions(self, start=None, end=None):
+        """Return start of existing partitions overlapping [start, end].
+        A partition ends at the latest where the next one starts, so this does not depend on partitionPeriod."""
+        partitionStarts = sorted([int(os.path.basename(path)) for path in glob.glob(os.path.join(self.path, '[0-9]*'))])
+        partitionEnds = partitionStarts[1:] + [float('inf')]
+
+        return [partitionStart for partitionStart, partitionEnd in zip(partitionStarts, partitionEnds)
+                if (start is None or partitionEnd > start) and (end is None or partitionStart <= end)]
+
+    def query(self, stsId, start=None, end=None, nMax=None):
+        """Return (timestamp, value, text) of that stsId between start and end, ordered by timestamp.
+        If nMax is given, only the nMax most recent datums are returned, and older partitions are not read."""
+        rows = []
+
+        for partitionStart in reversed(self.listPartitions(start, end)):
+            rows.extend(Partition(self.partitionPath(partitionStart)).query(stsId, start=start, end=end))
+            # partitions do not overlap, older ones would not make it.
+            if nMax is not None and len(rows) >= nMax:
+                break
+
+        rows = sorted(rows, key=lambda row: row[0])
+        return rows[-nMax:] if nMax else rows
+
+    def close(self):
+        with self.lock:
+            for partition in self.partitions.values():
+                partition.close()
+
+            self.partitions.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='query datums archived by the alerts actor.')
+    parser.add_argument('path', type=str, help='archive directory')
+    parser.add_argument('stsId', type=int)
+    parser.add_argument('--start', default=None, type=str, help='unix timestamp or ISO date (UTC unless offset given)')
+    parser.add_argument('--end', default=None, type=str, help='unix timestamp or ISO date (UTC unless offset given)')
+    args = parser.parse_args()
+
+    # only reading, the actor takes care of indexing.
+    archive = StsArchive(args.path, doIndex=False)
+
+    for timestamp, value, text in archive.query(args.stsId, start=parseTime(args.start), end=parseTime(args.end)):
+        print(f'{datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).isoformat()} {args.stsId} {value} "{text}"')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,348 @@
+import logging
+import queue
+import select
+import socket
+import threading
+import time
+
+import STSpy.STSpy.radio as stsRadio
+from alertsActor.utils.metrics import LatencyHistogram
+
+
+class StsConnection(object):
+    """Single long-lived STS write session, re-established with exponential backoff."""
+
+    def __init__(self, host, port, timeout=5, minBackoff=1, maxBackoff=60):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.minBackoff = minBackoff
+        self.maxBackoff = maxBackoff
+
+        self.lock = threading.Lock()
+        self.sock = None
+        self.backoff = minBackoff
+        self.retryAt = 0
+
+    @property
+    def isConnected(self):
+        return self.sock is not None
+
+    @property
+    def isAvailable(self):
+        """Connection is either open or allowed to retry."""
+        return self.isConnected or time.time() >= self.retryAt
+
+    def connect(self):
+        """Open socket and go through the write handshake."""
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+
+        try:
+            sock.sendall(b'W\n')
+            reply = b''
+            while not reply.endswith(b'\n'):
+                chunk = sock.recv(1)
+                if not chunk:
+                    raise ConnectionError('STS closed connection during handshake')
+                reply += chunk
+
+            if not reply.startswith(b'OK'):
+                raise ConnectionError(f'STS refused write session: {reply.decode().strip()}')
+        except Exception:
+            sock.close()
+            raise
+
+        self.sock = sock
+        self.backoff = self.minBackoff
+
+    def close(self):
+        """Close write session, telling STS that no more packet is coming."""
+        if self.sock is None:
+            return
+
+        try:
+            self.sock.sendall(b'\x00')
+        except OSError:
+            pass
+        finally:
+            self.sock.close()
+            self.sock = None
+
+    def isClosedByPeer(self):
+        """Check whether STS closed the session, sendall() would still succeed on a half-closed socket."""
+        readable, __, __ = select.select([self.sock], [], [], 0)
+        if not readable:
+            return False
+
+        try:
+            return self.sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+        except BlockingIOError:
+            return False
+        except OSError:
+            return True
+
+    def fail(self):
+        """Drop socket and schedule next connection attempt."""
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+        self.retryAt = time.time() + self.backoff
+        self.backoff = min(2 * self.backoff, self.maxBackoff)
+
+    def send(self, datums):
+        """Send datums, (re)connecting if necessary."""
+        with self.lock:
+            try:
+                # session might have been closed by STS (idle close, restart), datums would be silently lost.
+                if self.isConnected and self.isClosedByPeer():
+                    self.sock.close()
+                    self.sock = None
+
+                if not self.isConnected:
+                    self.connect()
+
+                self.sock.sendall(b''.join([stsRadio.Radio.pack(datum) for datum in datums]))
+            except OSError:
+                self.fail()
+                raise
+
+
+class StsSender(threading.Thread):
+    """Pool of persistent STS connections, shared by all controllers.
+    Datums are queued by the keyvar callbacks and actually sent by this thread."""
+    dropPolicies = ['oldest', 'newest']
+
+    def __init__(self, host, port=stsRadio.Radio.PORT, nConnections=1, queueSize=1000, dropPolicy='oldest',
+                 batchWindow=0.1, batchSize=500, spool=None, replayRate=1000, archive=None, **kwargs):
+        if dropPolicy not in StsSender.dropPolicies:
+            raise ValueError(f'unknown dropPolicy:{dropPolicy}, should be in {StsSender.dropPolicies}')
+
+        threading.Thread.__init__(self, name='stsSender', daemon=True)
+        self.host = host
+        self.port = port
+        self.logger = logging.getLogger('stsSender')
+        self.connections = [StsConnection(host, port, **kwargs) for i in range(nConnections)]
+        self.counter = 0
+
+        self.queue = queue.Queue(maxsize=queueSize)
+        self.dropPolicy = dropPolicy
+        self.nDropped = 0
+        self.nFailed = 0
+
+        # datums from all controllers are coalesced for batchWindow seconds or up to batchSize datums.
+        self.batchWindow = batchWindow
+        self.batchSize = batchSize
+        self.nWindows = 0
+        self.nBatched = 0
+        self.maxBatched = 0
+        self.lastBatched = 0
+
+        # optional store-and-forward spool, replayed at replayRate datums/s once STS is back.
+        self.spool = spool
+        self.replayRate = replayRate
+        self.lastReplay = time.monotonic()
+        self.nSpooled = 0
+        self.nReplayed = 0
+
+        self.transmitLatency = LatencyHistogram()
+        # optional archive of acknowledged datums.
+        self.archive = archive
+
+    def __str__(self):
+        nConnected = len([conn for conn in self.connections if conn.isConnected])
+        return (f'StsSender(host={self.host}:{self.port}, connected={nConnected}/{len(self.connections)}, '
+                f'queued={self.queue.qsize()}, dropped={self.nDropped}, failed={self.nFailed}, '
+                f'spooled={self.nSpooled}, replayed={self.nReplayed})')
+
+    @property
+    def batchStatus(self):
+        """Per-window statistics."""
+        meanBatched = self.nBatched / self.nWindows if self.nWindows else 0
+        return dict(windows=self.nWindows, datums=self.nBatched, mean=round(meanBatched, 1), max=self.maxBatched,
+                    last=self.lastBatched)
+
+    def genMetricsKey(self):
+        """Return queue depth, dropped, failed, spooled, replayed, windows and batched datums counters,
+        followed by count, mean, p50, p99 and max transmit latencies in ms."""
+        values = [self.queue.qsize(), self.nDropped, self.nFailed, self.nSpooled, self.nReplayed, self.nWindows,
+                  self.nBatched] + self.transmitLatency.values()
+        return f'stsSender_metrics={",".join(map(str, values))}'
+
+    def put(self, datums, onSent=None):
+        """Queue datums without ever blocking, onSent(datums) is called once STS has acknowledged them."""
+        if not datums:
+            return
+
+        while True:
+            try:
+                self.queue.put_nowait((datums, onSent))
+                return
+            except queue.Full:
+                pass
+
+            if self.dropPolicy == 'newest':
+                self.drop(datums)
+                return
+
+            # make room by dropping the oldest entry.
+            try:
+                olderDatums, __ = self.queue.get_nowait()
+                self.drop(olderDatums)
+            except queue.Empty:
+                pass
+
+    def drop(self, datums):
+        """Account for dropped datums."""
+        self.nDropped += len(datums)
+        self.logger.warning('STS queue is full(policy=%s), dropping %d datums', self.dropPolicy, len(datums))
+
+    @property
+    def doSpool(self):
+        """Spooled datums need to be sent first, so everything goes through the spool until it is empty."""
+        return self.spool is not None and not self.spool.isEmpty
+
+    def collect(self, timeout=None):
+        """Block until the first entry, then coalesce entries for batchWindow seconds or batchSize datums."""
+        try:
+            entries = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+
+        nDatums = len(entries[0][0])
+        closeAt = time.monotonic() + self.batchWindow
+
+        while nDatums < self.batchSize:
+            timeout = closeAt - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                entry = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+
+            entries.append(entry)
+            nDatums += len(entry[0])
+
+        return entries
+
+    def run(self):
+        """Send queued datums forever, one transmit per window."""
+        while True:
+            # do not wait forever for new datums if the spool needs to be replayed.
+            entries = self.collect(timeout=self.batchWindow if self.doSpool else None)
+
+            if entries:
+                self.sendWindow(entries)
+
+            if self.doSpool:
+                self.replay()
+
+    def sendWindow(self, entries):
+        """Transmit all datums collected within a window, spool them if STS is not available."""
+        datums = [datum for entryDatums, onSent in entries for datum in entryDatums]
+
+        self.nWindows += 1
+        self.nBatched += len(datums)
+        self.maxBatched = max(self.maxBatched, len(datums))
+        self.lastBatched = len(datums)
+        self.logger.debug('window #%d: %d datums from %d callbacks', self.nWindows, len(datums), len(entries))
+
+        try:
+            if self.doSpool:
+                self.spoolDatums(datums)
+            else:
+                try:
+                    self.transmit(datums)
+                except Exception:
+                    if self.spool is None:
+                        raise
+                    self.spoolDatums(datums)
+        except Exception as e:
+            self.nFailed += len(datums)
+            self.logger.warning('lost %d datums: %s', len(datums), e)
+            return
+
+        # datums are either acknowledged by STS or safely stored in the spool at this point.
+        for datums, onSent in entries:
+            if onSent is None:
+                continue
+            try:
+                onSent(datums)
+            except Exception as e:
+                self.logger.exception('onSent callback failed: %s', e)
+
+    def spoolDatums(self, datums):
+        """Store datums for later."""
+        self.spool.append(datums)
+        self.nSpooled += len(datums)
+
+    def replay(self):
+        """Send oldest spooled datums, in order and without exceeding replayRate."""
+        now = time.monotonic()
+        nMax = min(int((now - self.lastReplay) * self.replayRate), self.batchSize)
+        if nMax < 1:
+            return
+
+        datums, token = self.spool.read(nMax)
+
+        try:
+            self.transmit(datums)
+        except Exception:
+            return
+        finally:
+            self.lastReplay = now
+
+        self.spool.consume(token)
+        self.nReplayed += len(datums)
+
+        if self.spool.isEmpty:
+            self.logger.warning('spool fully replayed (%d datums so far)', self.nReplayed)
+
+    def nextConnection(self):
+        """Round-robin over the connections which are not waiting for a retry."""
+        for i in range(len(self.connections)):
+            conn = self.connections[(self.counter + i) % len(self.connections)]
+            if conn.isAvailable:
+                self.counter += i + 1
+                return conn
+
+        raise ConnectionError(f'no STS connection available to {self.host}:{self.port}, waiting to reconnect')
+
+    def transmit(self, datums):
+        """Transmit datums to STS, raise if it could not."""
+        if not datums:
+            return
+
+        conn = self.nextConnection()
+        start = time.perf_counter()
+
+        try:
+            conn.send(datums)
+            self.transmitLatency.record(time.perf_counter() - start)
+        except OSError as e:
+            self.logger.warning('failed to transmit to STS(%s:%d): %s, retrying in %ds',
+                                self.host, self.port, e, conn.retryAt - time.time())
+            raise
+
+        if self.archive is not None:
+            self.archiveDatums(datums)
+
+    def archiveDatums(self, datums):
+        """Archive acknowledged datums, failing to do so never prevents transmission."""
+        try:
+            self.archive.append(datums)
+        except Exception as e:
+            self.logger.warning('failed to archive %d datums: %s', len(datums), e)
+
+    def close(self):
+        """Close all connections."""
+        for conn in self.connections:
+            with conn.lock:
+                conn.close()
+
+        if self.spool is not None:
+            self.spool.close()
+
+        if self.archive is not None:
+            self.archive.close()
@@ -0,0 +1,185 @@
+import glob
+import logging
+import mmap
+import os
+import struct
+
+import STSpy.STSpy.datum as stsDatum
+
+
+class Segment(object):
+    """Fixed-size memory-mapped spool file.
+    The header holds the write and read offsets, so a segment can be resumed after a restart."""
+    MAGIC = b'STSP'
+    HEADER = struct.Struct('<4s4xQQ')
+
+    def __init__(self, path, size):
+        self.path = path
+        exists = os.path.exists(path)
+
+        with open(path, 'a+b') as f:
+            if not exists:
+                f.truncate(size)
+            self.map = mmap.mmap(f.fileno(), 0)
+
+        if exists:
+            magic, self.writeOffset, self.readOffset = Segment.HEADER.unpack_from(self.map)
+            if magic != Segment.MAGIC:
+                raise ValueError(f'{path} is not a STS spool segment')
+        else:
+            self.writeOffset = self.readOffset = Segment.HEADER.size
+            self.saveHeader()
+
+    @property
+    def size(self):
+        return len(self.map)
+
+    @property
+    def isEmpty(self):
+        return self.readOffset >= self.writeOffset
+
+    def saveHeader(self):
+        Segment.HEADER.pack_into(self.map, 0, Segment.MAGIC, self.writeOffset, self.readOffset)
+
+    def append(self, record):
+        """Append record, return False if it does not fit."""
+        if self.writeOffset + len(record) > self.size:
+            return False
+
+        self.map[self.writeOffset:self.writeOffset + len(record)] = record
+        self.writeOffset += len(record)
+        self.saveHeader()
+        return True
+
+    def read(self, nMax):
+        """Return up to nMax (record, nextOffset) from the read offset, without consuming them."""
+        records = []
+        offset = self.readOffset
+
+        while offset < self.writeOffset and len(records) < nMax:
+            datum, offset = unpackDatum(self.map, offset)
+            records.append((datum, offset))
+
+        return records
+
+    def consume(self, offset):
+        self.readOffset = offset
+        self.saveHeader()
+
+    def close(self, doDelete=False):
+        self.map.flush()
+        self.map.close()
+        if doDelete:
+            os.remove(self.path)
+
+
+RECORD = struct.Struct('<iBq8sH')
+FLOAT, INTEGER = 0, 1
+
+
+def packDatum(datum):
+    """Serialize a FloatWithText or IntegerWithText datum, preserving its original timestamp."""
+    stsValue, stsText = datum.value
+    text = stsText.encode()
+    if isinstance(stsValue, float):
+        valueType, value = FLOAT, struct.pack('<d', stsValue)
+    else:
+        valueType, value = INTEGER, struct.pack('<q', stsValue)
+
+    return RECORD.pack(datum.id, valueType, int(datum.timestamp), value, len(text)) + text
+
+
+def unpackDatum(buffer, offset=0):
+    """Rebuild datum from buffer, return datum and the offset of the next record."""
+    stsId, valueType, timestamp, value, textLength = RECORD.unpack_from(buffer, offset)
+    offset += RECORD.size
+    stsText = bytes(buffer[offset:offset + textLength]).decode()
+
+    if valueType == FLOAT:
+        stsType, [stsValue] = stsDatum.Datum.FloatWithText, struct.unpack('<d', value)
+    else:
+        stsType, [stsValue] = stsDatum.Datum.IntegerWithText, struct.unpack('<q', value)
+
+    return stsType(stsId, timestamp=timestamp, value=(stsValue, stsText)), offset + textLength
+
+
+class StsSpool(object):
+    """Append-only store-and-forward buffer of unsent datums, made of memory-mapped segment files.
+    When more than maxSegments are needed, the oldest segment is evicted."""
+
+    def __init__(self, path, segmentSize=4 * 1024 * 1024, maxSegments=64):
+        self.path = path
+        self.segmentSize = segmentSize
+        self.maxSegments = maxSegments
+        self.logger = logging.getLogger('stsSpool')
+        self.nEvicted = 0
+
+        os.makedirs(path, exist_ok=True)
+        # resume existing segments, oldest first.
+        self.segments = [Segment(filepath, segmentSize) for filepath in sorted(glob.glob(self.pattern('*')))]
+        self.cleanup()
+
+        if self.segments:
+            self.logger.warning('resuming %d spool segment(s) from %s', len(self.segments), path)
+
+    def __str__(self):
+        return f'StsSpool(path={self.path}, segments={len(self.segments)}, evicted={self.nEvicted})'
+
+    @property
+    def isEmpty(self):
+        return all([segment.isEmpty for segment in self.segments])
+
+    def pattern(self, index):
+        return os.path.join(self.path, f'{index}.spool')
+
+    def newSegment(self):
+        """Open a new segment, evicting the oldest one if necessary."""
+        index = int(os.path.basename(self.segments[-1].path).split('.')[0]) + 1 if self.segments else 0
+
+        while len(self.segments) >= self.maxSegments:
+            evicted = self.segments.pop(0)
+            self.logger.warning('spool is full, evicting %s with %d unsent bytes',
+                                evicted.path, evicted.writeOffset - evicted.readOffset)
+            evicted.close(doDelete=True)
+            self.nEvicted += 1
+
+        segment = Segment(self.pattern(f'{index:012d}'), self.segmentSize)
+        self.segments.append(segment)
+        return segment
+
+    def append(self, datums):
+        """Append datums to the spool."""
+        for datum in datums:
+            record = packDatum(datum)
+
+            if not self.segments or not self.segments[-1].append(record):
+                if not self.newSegment().append(record):
+                    raise ValueError(f'record larger than segmentSize:{self.segmentSize}')
+
+    def read(self, nMax):
+        """Return up to nMax of the oldest datums, they are only removed from the spool by consume()."""
+        for segment in self.segments:
+            if not segment.isEmpty:
+                records = segment.read(nMax)
+                datums = [datum for datum, offset in records]
+                return datums, (segment, records[-1][1])
+
+        return [], None
+
+    def consume(self, token):
+        """Mark datums returned by read() as sent."""
+        if token is None:
+            return
+
+        segment, offset = token
+        segment.consume(offset)
+        self.cleanup()
+
+    def cleanup(self):
+        """Delete fully sent segments, except the one currently written."""
+        while len(self.segments) > 1 and self.segments[0].isEmpty:
+            self.segments.pop(0).close(doDelete=True)
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()